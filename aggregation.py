@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+
+def group_codes(df, keys: list):
+    """
+    code of the group of each row (0, 1, ... in the sort order of the keys) and a frame with the
+    key values of each group. rows with a missing key get the code -1, as in groupby they belong
+    to no group.
+    """
+    grouper = df.groupby(keys, sort=True, observed=True)
+    codes = grouper.ngroup().to_numpy()
+    return codes, grouper.size().index.to_frame(index=False)
+
+
+def aggregate_sorted(codes, values, groups: int, quantiles: tuple = ()) -> dict:
+    """
+    mean and quantiles (in percent, linear interpolation as np.percentile) of values per group.
+    One sort by group and value puts each group into a contiguous, sorted block; the sums come from
+    a single bincount and every quantile of every group is read from its block by position, so a
+    further quantile costs one gather instead of a Python callback per group. Missing values are
+    skipped, groups without values get NaN.
+    """
+    values = np.asarray(values, dtype="float64")
+    valid = ~np.isnan(values) & (codes >= 0)
+    codes, values = codes[valid], values[valid]
+    if len(quantiles) > 0:
+        # sort by value, then stable by group: numpy sorts 16 bit codes with a radix sort
+        order = np.argsort(values)
+        group_order = codes[order].astype("uint16") if groups <= 2**16 else codes[order]
+        order = order[np.argsort(group_order, kind="stable")]
+        codes, values = codes[order], values[order]
+    counts = np.bincount(codes, minlength=groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result = {"mean": np.bincount(codes, weights=values, minlength=groups) / counts}
+    ends = np.cumsum(counts)
+    starts = ends - counts
+    filled = counts > 0
+    for q in quantiles:
+        position = starts[filled] + (counts[filled] - 1) * q / 100
+        lower = np.floor(position).astype("int64")
+        upper = np.minimum(lower + 1, ends[filled] - 1)
+        quantile = np.full(groups, np.nan)
+        quantile[filled] = values[lower] + (values[upper] - values[lower]) * (position - lower)
+        result[f"percentile_{q}"] = quantile
+    return result
+
+
+def aggregate_groups(df, keys: list, value_columns: list, quantiles: tuple = ()):
+    """
+    Mean and quantiles of each value column per group of keys, in long form: the key columns,
+    variable (the name of the value column), mean and percentile_<q> for each q in quantiles, like
+    df.melt(keys, value_columns).groupby(keys + ['variable']).agg(['mean', percentile(q), ...]).
+    The groups are found once for all value columns.
+    """
+    codes, df_groups = group_codes(df, keys)
+    frames = []
+    for column in value_columns:
+        result = aggregate_sorted(codes, df[column].to_numpy(), len(df_groups), quantiles)
+        df_result = df_groups.copy()
+        df_result["variable"] = column
+        for name, values in result.items():
+            df_result[name] = values
+        frames.append(df_result)
+    if len(frames) == 0:
+        return pd.DataFrame(columns=keys + ["variable", "mean"] + [f"percentile_{q}" for q in quantiles])
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,155 @@
+import time
+
+import altair as alt
+import numpy as np
+import pandas as pd
+
+# exact versions of the player scripts, vega-lite is the version of the schema altair writes the spec for
+VEGA_VERSION = "5.25.0"
+VEGALITE_VERSION = alt.SCHEMA_VERSION.lstrip("v")
+VEGAEMBED_VERSION = "6.22.2"
+VEGA_SCRIPTS = f"""<script src="https://cdn.jsdelivr.net/npm/vega@{VEGA_VERSION}"></script>
+<script src="https://cdn.jsdelivr.net/npm/vega-lite@{VEGALITE_VERSION}"></script>
+<script src="https://cdn.jsdelivr.net/npm/vega-embed@{VEGAEMBED_VERSION}"></script>"""
+
+# width of the wide flow chart in pixels, its line is reduced to at most one point per pixel
+WIDE_CHART_WIDTH = 600
+
+# player for the animation spec: steps the signal 'tag' in the browser, no request to the server per day
+PLAYER_HTML = """<div id="vis"></div>
+<button id="play">Animation starten</button> <button id="stop">Stop Animation</button>
+{scripts}
+<script>
+vegaEmbed("#vis", {spec}, {{actions: false}}).then(function(result) {{
+    const view = result.view;
+    const lastDay = {last_day};
+    let timer = null;
+    document.getElementById("play").onclick = function() {{
+        clearInterval(timer);
+        if (view.signal("tag") >= lastDay) {{
+            view.signal("tag", 0).runAsync();
+        }}
+        timer = setInterval(function() {{
+            const day = view.signal("tag") + 1;
+            view.signal("tag", day).runAsync();
+            if (day >= lastDay) {{
+                clearInterval(timer);
+            }}
+        }}, {milliseconds_per_day});
+    }};
+    document.getElementById("stop").onclick = function() {{
+        clearInterval(timer);
+    }};
+}});
+</script>
+"""
+
+
+def downsample_min_max(df, y: str, max_points: int = WIDE_CHART_WIDTH):
+    """
+    Level of detail for line charts: splits the rows into max_points / 2 buckets of consecutive
+    rows and keeps the row with the minimum and the one with the maximum of y of each bucket, in
+    their original order. All peaks survive, which matters for floods, and the line looks the same
+    at the chart resolution. Frames with at most max_points rows are returned unchanged.
+    """
+    rows = len(df)
+    if rows <= max_points:
+        return df
+    buckets = max_points // 2
+    bucket_size = -(-rows // buckets)
+    values = np.full(buckets * bucket_size, np.nan)
+    values[:rows] = df[y].to_numpy(dtype="float64")
+    values = values.reshape(buckets, bucket_size)
+    offsets = np.arange(buckets) * bucket_size
+    minima = offsets + np.argmin(np.where(np.isnan(values), np.inf, values), axis=1)
+    maxima = offsets + np.argmax(np.where(np.isnan(values), -np.inf, values), axis=1)
+    keep = np.unique(np.concatenate([minima, maxima]))
+    return df.iloc[keep[keep < rows]]
+
+
+def paced_frames(frames: int, seconds_per_frame: float, clock=time.monotonic, sleep=time.sleep):
+    """
+    Generator of the frame numbers a server side playback should render, keeping the wall-clock
+    speed of seconds_per_frame: frame i is due at start + i * seconds_per_frame. The time the caller
+    needs to render a frame is taken from the pause before the next one. If rendering falls behind,
+    the frames that are overdue are skipped and the most recent due frame is rendered instead; the
+    last frame is always rendered. The generator returns after the last frame, so the script thread
+    is released as soon as playback ends or the caller stops iterating.
+    """
+    start = clock()
+    frame = 0
+    while frame < frames:
+        yield frame
+        if frame == frames - 1:
+            return
+        due_frame = int((clock() - start) / seconds_per_frame)
+        if due_frame > frame:
+            # behind schedule: show the frame that is due now without pausing
+            frame = min(due_frame, frames - 1)
+        else:
+            frame += 1
+            sleep(max(0, start + frame * seconds_per_frame - clock()))
+
+
+def get_animation_data(flow_df, precipitation_df, start_day, end_day):
+    """
+    one row per day from start_day to end_day with the column tag (0, 1, ...) the animation steps
+    through, flow, precipitation and the texts shown for the day. missing values stay NaN, the
+    line and the bars have no point on such a day, only the texts show them as 0.
+    """
+    days = pd.date_range(start_day, end_day, freq="D")
+    df = pd.DataFrame({"date": days})
+    df = df.merge(flow_df[["date", "abfluss"]], on="date", how="left")
+    df = df.merge(precipitation_df[["date", "prec_mm"]], on="date", how="left")
+    df["tag"] = range(len(df))
+    df["datum"] = df["date"].dt.strftime("%d.%m.%Y")
+    df["text_prec"] = [f"Niederschlag: {x :.1f} mm" for x in df["prec_mm"].fillna(0)]
+    df["text_flow"] = [f"Abflussmenge: {x :.1f} m³/s" for x in df["abfluss"].fillna(0)]
+    return df
+
+
+def get_animation_chart(df):
+    """
+    the complete animation as a single chart: the wide flow line with a marker on the current day,
+    bars for precipitation and flow of the day and their values. the current day is the parameter
+    tag, bound to a slider, changing it only filters the embedded data.
+    """
+    tag = alt.param(
+        name="tag",
+        value=0,
+        bind=alt.binding_range(min=0, max=len(df) - 1, step=1, name="Tag "),
+    )
+    base = alt.Chart(df)
+    current_day = base.transform_filter(alt.datum.tag == tag)
+    x = alt.X("date:T", axis=alt.Axis(title=""))
+    flow_y = alt.Y("abfluss:Q", axis=alt.Axis(title="Abflussmenge (m³/s"), scale=alt.Scale(domain=[0, 4000]))
+    prec_y = alt.Y("prec_mm:Q", axis=alt.Axis(title="Niederschlag (mm/Tag)"), scale=alt.Scale(domain=[0, 40]))
+
+    day_text = current_day.mark_text(fontSize=16, fontWeight="bold", align="left").encode(text="datum:N")
+    wide_chart = base.mark_line().encode(x=x, y=flow_y) + current_day.mark_point(
+        size=60, color="red", filled=True
+    ).encode(x=x, y=flow_y)
+    prec_chart = current_day.mark_bar(width=50).encode(x=x, y=prec_y).properties(
+        width=250, height=300, title="Niederschlag, Messtation Binningen (mm)"
+    )
+    flow_chart = current_day.mark_bar(width=50).encode(x=x, y=flow_y).properties(
+        width=250, height=300, title="Abflussmenge Rhein (m³/s)"
+    )
+    prec_text = current_day.mark_text(align="left").encode(text="text_prec:N").properties(width=250, height=20)
+    flow_text = current_day.mark_text(align="left").encode(text="text_flow:N").properties(width=250, height=20)
+    chart = alt.vconcat(
+        day_text.properties(width=WIDE_CHART_WIDTH, height=20),
+        wide_chart.properties(width=WIDE_CHART_WIDTH, height=300, title="Abflussmenge Rhein (m³/s)"),
+        alt.hconcat(prec_chart, flow_chart),
+        alt.hconcat(prec_text, flow_text),
+    ).add_params(tag)
+    return chart
+
+
+def get_player_html(spec_json: str, days: int, seconds_per_day: float):
+    return PLAYER_HTML.format(
+        scripts=VEGA_SCRIPTS,
+        spec=spec_json,
+        last_day=days - 1,
+        milliseconds_per_day=int(seconds_per_day * 1000),
+    )
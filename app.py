@@ -1,5 +1,6 @@
 import streamlit as st
 from rhein_flow import RheinFlow
+from data_store import get_data_store
 
 __version__ = "0.1.1"
 __author__ = "Lukas Calmbach"
@@ -28,10 +29,8 @@ def init():
 
 def main():
     init()
-    if "rhein_flow" not in st.session_state:
-        st.session_state.rhein_flow = RheinFlow()
-
-    st.session_state.rhein_flow.show_gui()
+    # the data is shared by all sessions and kept up to date in the background
+    RheinFlow(get_data_store()).show_gui()
     st.markdown(APP_INFO, unsafe_allow_html=True)
 
 
@@ -0,0 +1,377 @@
+# micro-benchmarks for the data paths of the app, run e.g. with: python benchmarks.py extract
+# the benchmarks use synthetic data with the structure of the data.bs datasets and do not access the network.
+
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import timeit
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from aggregation import aggregate_groups
+from animation import downsample_min_max
+from chart_cache import ChartCache
+from cubes import box_cube, box_lookup, box_summary, heatmap_cube, heatmap_means
+from daily_series import DailySeries
+from data_store import Snapshot, data_dict, extract_records, load_local_data
+from partitioned_store import PartitionedStore
+from rhein_flow import RheinFlow
+from time_index import TimeIndex
+
+
+def make_records(n: int):
+    """
+    api records of the flow dataset in 10 minute steps, as returned by the records api.
+    """
+    zeit = pd.date_range("2020-01-01", periods=n, freq="10min", tz="UTC")
+    values = np.random.default_rng(0).uniform(500, 4000, n)
+    return [
+        {"datasetid": "100089", "fields": {"timestamp": t.isoformat(), "abfluss": v}}
+        for t, v in zip(zeit, values)
+    ]
+
+
+def report(name: str, func, number: int = 5):
+    seconds = min(timeit.repeat(func, number=1, repeat=number))
+    print(f"{name:<40} {seconds * 1000:10.1f} ms")
+    return seconds
+
+
+def bench_extract():
+    def extract_rowwise(data):
+        # extraction before the columnar path: unpack the fields into a second frame, parse the time stamps twice
+        df_ogd = pd.DataFrame(data["records"])["fields"]
+        df_ogd = pd.DataFrame(x for x in df_ogd)
+        df_ogd.rename(columns={"timestamp": "zeit"}, inplace=True)
+        df_ogd["zeit"] = pd.to_datetime(df_ogd["zeit"])
+        df_ogd["date"] = pd.to_datetime(df_ogd["zeit"]).dt.date
+        return df_ogd
+
+    source = data_dict["flow"]
+    for n in [10_000, 100_000]:
+        records = make_records(n)
+        before = report(f"extract row-wise, {n} records", lambda: extract_rowwise({"records": records}))
+        after = report(f"extract columnar, {n} records", lambda: extract_records(records, source))
+        print(f"{'speed-up':<40} {before / after:10.1f} x")
+
+
+def make_daily(years: int):
+    dates = pd.date_range("2000-01-01", periods=years * 365, freq="D")
+    return pd.DataFrame({"date": dates, "abfluss": np.random.default_rng(0).uniform(500, 4000, len(dates))})
+
+
+def bench_lookup():
+    # lookups of one animation playback over the whole range: the day and all days since the start
+    for years in [3, 10]:
+        df = make_daily(years)
+        snapshot = Snapshot(DailySeries.from_frame(df), {}, 1, 0)
+        days = list(df["date"])
+
+        def playback_masks():
+            for day in days:
+                df[df["date"] >= days[0]]
+                df[df["date"] == day]
+
+        def playback_index():
+            for day in days:
+                snapshot.between(days[0])
+                snapshot.day(day)
+
+        before = report(f"playback masks, {years} years", playback_masks, number=3)
+        after = report(f"playback binary search, {years} years", playback_index, number=3)
+        print(f"{'speed-up':<40} {before / after:10.1f} x")
+
+
+def bench_overview():
+    # wide chart of the server playback: build and serialise the chart, as done for every day
+    for years in [3, 10]:
+        df = make_daily(years)
+        point_df = df.iloc[-1:]
+
+        def render(df_line):
+            chart = RheinFlow.get_line_chart(None, df_line, point_df, "date", "abfluss", [0, 4000], "Abflussmenge (m³/s")
+            return chart.to_json()
+
+        df_overview = downsample_min_max(df, "abfluss")
+        print(f"payload {years} years: {len(render(df)) / 1e3:.0f} kB with {len(df)} points, "
+              f"{len(render(df_overview)) / 1e3:.0f} kB with {len(df_overview)} points")
+        before = report(f"render wide chart, {years} years", lambda: render(df))
+        after = report(f"render downsampled, {years} years", lambda: render(downsample_min_max(df, "abfluss")))
+        print(f"{'speed-up':<40} {before / after:10.1f} x")
+
+
+def bench_charts():
+    # specs of one server playback day: the wide chart and the two bar charts, built or taken from the cache
+    df = make_daily(3)
+    df_overview = downsample_min_max(df, "abfluss")
+    days = list(df["date"][-90:])
+    cache = ChartCache()
+
+    def specs(day, get):
+        point_df = df[df["date"] == day]
+        get(("wide_line", 1, day), lambda: RheinFlow.get_line_chart(None, df_overview, point_df, "date", "abfluss", [0, 4000], ""))
+        get(("flow_bar", 1, day), lambda: RheinFlow.get_bar_chart(None, point_df, "date", "abfluss", [0, 4000], ""))
+        get(("prec_bar", 1, day), lambda: RheinFlow.get_bar_chart(None, point_df, "date", "abfluss", [0, 40], ""))
+
+    def playback_build():
+        for day in days:
+            specs(day, lambda key, build: build().to_dict())
+
+    def playback_cached():
+        for day in days:
+            specs(day, cache.get)
+
+    playback_cached()
+    before = report("playback 90 days, build specs", playback_build, number=3)
+    after = report("playback 90 days, cached specs", playback_cached, number=3)
+    print(f"{'speed-up':<40} {before / after:10.1f} x")
+
+
+def resident_memory() -> int:
+    # resident set size of the process in bytes, linux only
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def bench_memory():
+    # memory of the daily values per dataset: frame with the sorted date index of the binary search against DailySeries
+    for key, source in data_dict.items():
+        df = load_local_data(source)
+        years = len(df) / 365
+        frame_bytes = df.memory_usage(deep=True).sum() + len(df) * 8
+        series = DailySeries.from_frame(df)
+        print(f"{key}: {len(df)} days, frame {frame_bytes / years / 1e3:.1f} kB/year, "
+              f"series {series.nbytes / years / 1e3:.1f} kB/year")
+    # resident memory of 100 years of flow in 200 sessions, e.g. copies in session state
+    df = make_daily(100)
+    df["pegel"] = df["abfluss"] / 1000
+    for name, make in [("frame", lambda: df.copy()), ("series", lambda: DailySeries.from_frame(df))]:
+        before = resident_memory()
+        copies = [make() for _ in range(200)]
+        print(f"{'rss 200 x 100 years, ' + name:<40} {(resident_memory() - before) / 1e6:10.1f} MB")
+        del copies
+
+
+def make_measurements(years: int, parameters: int = 3):
+    # 10 minute values of a station with the time columns of the legacy analysis view
+    zeit = pd.date_range("2010-01-01", periods=years * 365 * 144, freq="10min")
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({"zeit": zeit, "jahr": zeit.year, "monat": zeit.month, "stunde": zeit.hour})
+    for i in range(parameters):
+        df[f"par{i}"] = rng.gamma(2, 10, len(df))
+    return df
+
+
+def bench_filter():
+    # plots.App.filter_data: a date range of one year and a year range of half the history
+    def filter_masks(df, date_from, date_to, years):
+        df_dates = df[(df["zeit"].dt.date >= date_from) & (df["zeit"].dt.date <= date_to)]
+        df_years = df[df["jahr"].isin(range(years[0], years[1]))]
+        return df_dates, df_years
+
+    def filter_index(index, date_from, date_to, years):
+        return index.slice(*index.date_bounds(date_from, date_to)), index.slice(*index.year_bounds(*years))
+
+    for years in [3, 10]:
+        df = make_measurements(years)
+        index = TimeIndex(df)
+        date_from, date_to = date(2011, 3, 1), date(2012, 2, 29)
+        year_range = (2010, 2010 + years // 2)
+        before = report(f"filter masks, {years} years ({len(df)} rows)", lambda: filter_masks(df, date_from, date_to, year_range), number=3)
+        after = report(f"filter binary search, {years} years", lambda: filter_index(index, date_from, date_to, year_range))
+        print(f"{'speed-up':<40} {before / after:10.1f} x")
+        expected, result = filter_masks(df, date_from, date_to, year_range), filter_index(index, date_from, date_to, year_range)
+        assert all(x.equals(y) for x, y in zip(expected, result))
+        print(f"{'slice shares the column data':<40} {np.shares_memory(result[0]['par0'].to_numpy(), df['par0'].to_numpy())}")
+
+
+def percentile(n):
+    # the percentile aggregation of tools.py used by the legacy analysis view
+    def percentile_(x):
+        return np.percentile(x, n)
+
+    percentile_.__name__ = f"percentile_{n}"
+    return percentile_
+
+
+def bench_band():
+    # plots.App.show_linechart.prepare_data on hourly values of 10 years, with and without the 90% band
+    def prepare_melt(df, col, par, show_band):
+        df = df.melt(id_vars=[col], value_vars=par)
+        aggregates = ["mean", percentile(5), percentile(95)] if show_band else ["mean"]
+        return df.groupby([col, "variable"])["value"].agg(aggregates).reset_index()
+
+    zeit = pd.date_range("2010-01-01", periods=10 * 365 * 24, freq="h")
+    df = pd.DataFrame({"zeit": zeit, "datum": zeit.normalize(), "mitte_monat": zeit.to_period("M").start_time + pd.Timedelta(days=14)})
+    df["PM10"] = np.random.default_rng(0).gamma(2, 10, len(df))
+    for col in ["mitte_monat", "datum"]:
+        groups = df[col].nunique()
+        report(f"melt + groupby mean, {groups} groups", lambda: prepare_melt(df, col, "PM10", False), number=3)
+        report(f"melt + groupby band, {groups} groups", lambda: prepare_melt(df, col, "PM10", True), number=1)
+        report(f"aggregate_groups mean, {groups} groups", lambda: aggregate_groups(df, [col], ["PM10"]))
+        report(f"aggregate_groups band, {groups} groups", lambda: aggregate_groups(df, [col], ["PM10"], (5, 95)))
+        expected = prepare_melt(df, col, "PM10", True)
+        result = aggregate_groups(df, [col], ["PM10"], (5, 95))
+        assert np.allclose(expected[["mean", "percentile_5", "percentile_95"]], result[["mean", "percentile_5", "percentile_95"]])
+
+
+def bench_cubes():
+    # plots.App.show_heatmap and show_boxplot on 10 years of 10 minute values, half of the years selected
+    df = make_measurements(10)
+    df["datum"] = df["zeit"].dt.normalize()
+    df["mitte_woche"] = df["zeit"].dt.to_period("W").dt.start_time + pd.Timedelta(days=3)
+    parameters = ["par0", "par1", "par2"]
+    years = (2012, 2017)
+    df_years = df[(df["jahr"] >= years[0]) & (df["jahr"] < years[1])]
+
+    def box_rows(x, base):
+        df_box = df_years
+        if base is not None:
+            df_box = df_box.groupby([x, base])["par0"].mean().reset_index()
+        return box_summary(df_box, [x], ["par0"])
+
+    cube = heatmap_cube(df, "stunde", "monat", parameters)
+    report("heatmap cube, built once", lambda: heatmap_cube(df, "stunde", "monat", parameters), number=1)
+    before = report("heatmap groupby of the rows", lambda: df_years.groupby(["stunde", "monat"])["par0"].mean(), number=3)
+    after = report("heatmap from the cube", lambda: heatmap_means(cube, "stunde", "monat", ["par0"], years))
+    print(f"{'speed-up':<40} {before / after:10.1f} x")
+    expected = df_years.groupby(["stunde", "monat"])["par0"].mean()
+    assert np.allclose(expected, heatmap_means(cube, "stunde", "monat", ["par0"], years)["mean"])
+    for x, base in [("monat", "datum"), ("mitte_woche", None)]:
+        cube = box_cube(df, x, parameters, base)
+        report(f"box cube {x}, built once", lambda: box_cube(df, x, parameters, base), number=1)
+        before = report(f"boxes {x} from the rows", lambda: box_rows(x, base), number=3)
+        after = report(f"boxes {x} from the cube", lambda: box_lookup(cube, x, ["par0"], years, base))
+        print(f"{'speed-up':<40} {before / after:10.1f} x")
+        expected = box_rows(x, base)[0].sort_values(x, ignore_index=True)
+        result = box_lookup(cube, x, ["par0"], years, base)[0].sort_values(x, ignore_index=True)
+        assert np.allclose(expected[["lower", "q1", "median", "q3", "upper"]], result[["lower", "q1", "median", "q3", "upper"]])
+
+
+def bench_parameters():
+    # plots.App.show_linechart on 3 years of 10 minute values: per parameter (filter and group the rows
+    # for each parameter) against all selected parameters at once, with and without the 90% band
+    df = make_measurements(3, parameters=6)
+    df["datum"] = df["zeit"].dt.normalize()
+    index = TimeIndex(df)
+
+    def per_parameter(parameters, quantiles):
+        frames = []
+        for par in parameters:
+            df_par = index.slice(*index.date_bounds(date(2010, 1, 1), date(2012, 12, 31)))
+            frames.append(aggregate_groups(df_par, ["datum"], [par], quantiles))
+        return pd.concat(frames, ignore_index=True)
+
+    def batched(parameters, quantiles):
+        df_all = index.slice(*index.date_bounds(date(2010, 1, 1), date(2012, 12, 31)))
+        return aggregate_groups(df_all, ["datum"], parameters, quantiles)
+
+    for quantiles, label in [((), "mean"), ((5, 95), "band")]:
+        for count in [1, 3, 6]:
+            parameters = [f"par{i}" for i in range(count)]
+            before = report(f"per parameter {label}, {count} parameters", lambda: per_parameter(parameters, quantiles), number=3)
+            after = report(f"batched {label}, {count} parameters", lambda: batched(parameters, quantiles), number=3)
+            print(f"{'speed-up':<40} {before / after:10.1f} x")
+            assert per_parameter(parameters, quantiles).equals(batched(parameters, quantiles))
+
+
+def memory_status() -> dict:
+    # anonymous (private) and file backed (shareable) resident memory of the process in bytes, linux only
+    with open("/proc/self/status") as f:
+        lines = dict(x.split(":", 1) for x in f)
+    return {key: int(lines[key].split()[0]) * 1024 for key in ["RssAnon", "RssFile"]}
+
+
+def load_history(how: str, path: str):
+    # runs in a fresh process: load the daily values and touch every value, as a chart of the whole range does
+    before = memory_status()
+    start = time.perf_counter()
+    if how == "parquet":
+        series = DailySeries.from_frame(PartitionedStore(path).read())
+    else:
+        series = DailySeries.load(path + ".arrow")
+    sum(x.sum() for x in series.values.values())
+    seconds = time.perf_counter() - start
+    after = memory_status()
+    return seconds, {key: after[key] - before[key] for key in after}
+
+
+def bench_startup():
+    # startup of a worker process: parse the parquet partitions into fresh memory against mapping the series file
+    context = multiprocessing.get_context("spawn")
+    for years in [50, 200]:
+        with tempfile.TemporaryDirectory() as path:
+            df = make_daily(years)
+            df["date"] = pd.date_range("1700-01-01", periods=len(df), freq="D")
+            df["pegel"] = df["abfluss"] / 1000
+            PartitionedStore(path).write(df)
+            DailySeries.from_frame(df).save(path + ".arrow")
+            for how in ["parquet", "mmap"]:
+                with context.Pool(1) as pool:
+                    seconds, rss = pool.apply(load_history, (how, path))
+                print(f"{f'startup {how}, {years} years':<40} {seconds * 1000:10.1f} ms   "
+                      f"private {rss['RssAnon'] / 1e3:8.0f} kB   shared {rss['RssFile'] / 1e3:8.0f} kB")
+            os.remove(path + ".arrow")
+
+
+def open_landing_page(views: list):
+    # runs in a fresh process: real script runs of app.py, first the landing page (Info) and then
+    # the views selected one after the other. the refresher is not started, no request is sent.
+    from streamlit.testing.v1 import AppTest
+
+    import data_store
+
+    data_store.Refresher.start = lambda self: None
+    loaded = []
+    load_dataset = data_store.load_dataset
+
+    def record_load(source):
+        loaded.append(source["dataset"])
+        return load_dataset(source)
+
+    data_store.load_dataset = record_load
+    names = {source["dataset"]: key for key, source in data_dict.items()}
+    app = AppTest.from_file("app.py", default_timeout=120)
+    results = []
+    for view in views:
+        if view != "Info":
+            app.radio(key="view").set_value(view)
+        loaded.clear()
+        start = time.perf_counter()
+        app.run()
+        seconds = time.perf_counter() - start
+        assert not app.exception, app.exception
+        results.append((view, seconds, [names[x] for x in loaded]))
+    return results
+
+
+def bench_first_paint():
+    # time of the script run until the header and the view are sent, and the datasets loaded by it
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        results = pool.apply(open_landing_page, (["Info", "Statistiken", "Animierte Grafik"],))
+    for view, seconds, loaded in results:
+        print(f"{'script run, ' + view:<40} {seconds * 1000:10.1f} ms   datasets loaded: {', '.join(loaded) or '-'}")
+
+
+benchmarks = {
+    "extract": bench_extract,
+    "lookup": bench_lookup,
+    "overview": bench_overview,
+    "charts": bench_charts,
+    "memory": bench_memory,
+    "startup": bench_startup,
+    "first_paint": bench_first_paint,
+    "filter": bench_filter,
+    "band": bench_band,
+    "cubes": bench_cubes,
+    "parameters": bench_parameters,
+}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or benchmarks.keys():
+        benchmarks[name]()
@@ -0,0 +1,49 @@
+import json
+import threading
+from collections import OrderedDict
+
+# upper limit of the serialised specs held by a cache, a browser animation over three years is about 600 kB
+MAX_CACHE_BYTES = 32 * 1024 * 1024
+
+
+class ChartCache():
+    """
+    Bounded LRU cache of serialised Vega-Lite specs, shared by all sessions of the process. The
+    key must identify everything the chart depends on, e.g. (kind, snapshot version, date window,
+    y-domain), so an entry never has to be invalidated: a sync publishes a new version and the specs
+    of the old one are evicted once they are no longer requested. Specs are stored as JSON strings,
+    get() returns a new dict on every call, so a caller may modify it.
+    """
+
+    def __init__(self, max_bytes: int = MAX_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._specs = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple, build) -> dict:
+        """
+        returns the spec of key, build() is called to create the Altair chart on a miss. concurrent
+        misses on the same key may both build the chart, the specs are identical.
+        """
+        return json.loads(self.get_json(key, build))
+
+    def get_json(self, key: tuple, build) -> str:
+        with self._lock:
+            spec = self._specs.get(key)
+            if spec is not None:
+                self._specs.move_to_end(key)
+                self.hits += 1
+                return spec
+            self.misses += 1
+        spec = build().to_json(indent=None)
+        with self._lock:
+            if key not in self._specs:
+                self._specs[key] = spec
+                self._size += len(spec)
+            while self._size > self.max_bytes and len(self._specs) > 1:
+                _, evicted = self._specs.popitem(last=False)
+                self._size -= len(evicted)
+        return spec
@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+
+from aggregation import aggregate_sorted, group_codes
+
+# whiskers of the boxplots reach the most extreme values within 1.5 interquartile ranges of the box, as in Vega-Lite
+WHISKER_EXTENT = 1.5
+summary_columns = ["lower", "q1", "median", "q3", "upper"]
+
+
+def year_mask(df, years, year_column: str = "jahr"):
+    """
+    rows of the years years[0] to years[1] (exclusive), all rows if years is None.
+    """
+    if years is None:
+        return np.ones(len(df), dtype=bool)
+    return ((df[year_column] >= years[0]) & (df[year_column] < years[1])).to_numpy()
+
+
+def heatmap_cube(df, x: str, y: str, value_columns: list, year_column: str = "jahr") -> dict:
+    """
+    Sum and count of each value column per year and heatmap cell (x, y), computed once over the full
+    history. Any range of years can be aggregated from the cube, see heatmap_means.
+    """
+    keys = list(dict.fromkeys([year_column, x, y]))
+    grouped = df.groupby(keys, observed=True)[value_columns]
+    return {"sum": grouped.sum().reset_index(), "count": grouped.count().reset_index()}
+
+
+def heatmap_means(cube: dict, x: str, y: str, value_columns: list, years=None, year_column: str = "jahr"):
+    """
+    mean of each value column per cell (x, y) over the selected years, as df.groupby([x, y]).mean(),
+    in long form: x, y, variable (the name of the value column) and mean.
+    """
+    mask = year_mask(cube["sum"], years, year_column)
+    sums = cube["sum"][mask].groupby([x, y])[value_columns].sum()
+    counts = cube["count"][mask].groupby([x, y])[value_columns].sum()
+    means = sums / counts
+    # long form by stacking the columns, as df.melt but without its overhead
+    df = pd.concat([means.index.to_frame(index=False)] * len(value_columns), ignore_index=True)
+    df["variable"] = np.repeat(value_columns, len(means))
+    df["mean"] = means.to_numpy().ravel(order="F")
+    return df
+
+
+def box_summary(df, keys: list, value_columns: list):
+    """
+    Five-number summary of each value column per group of keys, as drawn by a boxplot: quartiles
+    q1, median, q3 and the whiskers lower and upper, plus the outliers beyond the whiskers. Returns
+    two long frames, the summaries (keys, variable, lower, q1, median, q3, upper) and the outliers
+    (keys, variable, value).
+    """
+    codes, df_groups = group_codes(df, keys)
+    groups = len(df_groups)
+    summaries, outliers = [], []
+    for column in value_columns:
+        values = df[column].to_numpy(dtype="float64")
+        quartiles = aggregate_sorted(codes, values, groups, (25, 50, 75))
+        q1, median, q3 = quartiles["percentile_25"], quartiles["percentile_50"], quartiles["percentile_75"]
+        valid = ~np.isnan(values) & (codes >= 0)
+        group, value = codes[valid], values[valid]
+        iqr = q3 - q1
+        inside = (value >= (q1 - WHISKER_EXTENT * iqr)[group]) & (value <= (q3 + WHISKER_EXTENT * iqr)[group])
+        lower, upper = np.full(groups, np.inf), np.full(groups, -np.inf)
+        np.minimum.at(lower, group[inside], value[inside])
+        np.maximum.at(upper, group[inside], value[inside])
+        df_summary = df_groups.copy()
+        df_summary["variable"] = column
+        for name, stat in zip(summary_columns, [lower, q1, median, q3, upper]):
+            df_summary[name] = np.where(np.isinf(stat), np.nan, stat)
+        summaries.append(df_summary.dropna(subset=["median"]))
+        df_outliers = df[keys][valid][~inside].reset_index(drop=True)
+        df_outliers["variable"] = column
+        df_outliers["value"] = value[~inside]
+        outliers.append(df_outliers)
+    return pd.concat(summaries, ignore_index=True), pd.concat(outliers, ignore_index=True)
+
+
+def box_cube(df, x: str, value_columns: list, base: str = None, year_column: str = "jahr") -> dict:
+    """
+    Precomputed boxplots of each value column per x, for box_lookup.
+    With base (e.g. datum) the boxes summarise the means per base value, the cube holds these means
+    per year, a few hundred rows per year, and the boxes are computed from the selected years.
+    Without base the boxes summarise the values and x lies within a year (mitte_monat, mitte_woche),
+    the cube holds the finished boxes per x. For the x spanning two years, e.g. a week around new
+    year, it also holds the boxes of each year's part, used if only one of the years is selected.
+    """
+    if base is not None:
+        df_base = df.groupby([year_column, x, base], observed=True)[value_columns].mean().reset_index()
+        return {"base": df_base}
+    summary, outliers = box_summary(df, [x], value_columns)
+    years = df.groupby(x, observed=True)[year_column].agg(["min", "max"])
+    split = years.index[years["min"] != years["max"]]
+    partial_summary, partial_outliers = box_summary(df[df[x].isin(split)], [year_column, x], value_columns)
+    return {
+        "summary": summary,
+        "outliers": outliers,
+        "years": years.reset_index(),
+        "partial_summary": partial_summary,
+        "partial_outliers": partial_outliers,
+    }
+
+
+def box_lookup(cube: dict, x: str, value_columns: list, years=None, base: str = None, year_column: str = "jahr"):
+    """
+    summaries and outliers of the boxes of each value column over the selected years, see box_summary.
+    """
+    if base is not None:
+        df_base = cube["base"][year_mask(cube["base"], years, year_column)]
+        return box_summary(df_base, [x], value_columns)
+
+    def select(df, rows):
+        return df[df["variable"].isin(value_columns) & df[x].isin(rows)].reset_index(drop=True)
+
+    df_years = cube["years"]
+    if years is None:
+        complete = df_years[x]
+    else:
+        complete = df_years[x][(df_years["min"] >= years[0]) & (df_years["max"] < years[1])]
+    summary, outliers = select(cube["summary"], complete), select(cube["outliers"], complete)
+    if years is not None:
+        # parts of the x spanning the first or last selected year and a year outside the range
+        partial = [select(cube[key], df_years[x]) for key in ["partial_summary", "partial_outliers"]]
+        partial = [df[year_mask(df, years, year_column) & ~df[x].isin(complete)].drop(columns=year_column) for df in partial]
+        summary = pd.concat([summary, partial[0]], ignore_index=True)
+        outliers = pd.concat([outliers, partial[1]], ignore_index=True)
+    return summary, outliers
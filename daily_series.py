@@ -0,0 +1,124 @@
+import json
+import os
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# day 0 of the day offsets
+EPOCH = np.datetime64("1970-01-01", "D")
+
+
+def to_day(value, round_up: bool = False) -> int:
+    """
+    day offset of a date or time stamp. with round_up a time after midnight counts as the next day,
+    so a range starting at the time stamp does not include its day.
+    """
+    timestamp = pd.Timestamp(value).to_datetime64()
+    day = timestamp.astype("datetime64[D]")
+    return int((day - EPOCH).astype("int64")) + int(round_up and day < timestamp)
+
+
+class DailySeries():
+    """
+    Compact, read-only form of a dataset with one row per day, sorted by date: the dates are stored
+    as int32 day offsets from 1970-01-01 and each value column as float32, about 7 significant
+    digits, more than the measurements have.
+
+    Memory budget per year of data: 365 * 4 bytes for the days and 365 * 4 bytes per value column,
+    i.e. 4.4 kB for the flow (abfluss, pegel) and 2.9 kB for the precipitation. The same data as a
+    frame with datetime64[ns] and float64 columns takes twice as much, plus 2.9 kB for a sorted
+    datetime64 index to search in. The calendar fields dates, year and month are computed on first
+    access and add 8, 2 and 1 bytes per day.
+
+    A series saved with save() is loaded with load() as a memory map, its arrays are the mapped
+    pages of the file and take no memory of their own, see load().
+    """
+
+    def __init__(self, days, values: dict, metadata: dict = None):
+        self.days = np.asarray(days, dtype="int32")
+        self.values = {name: np.asarray(column, dtype="float32") for name, column in values.items()}
+        # e.g. the state of the partitions the series was built from, see save()
+        self.metadata = metadata or {}
+
+    @classmethod
+    def from_frame(cls, df, date_column: str = "date"):
+        if not df[date_column].is_monotonic_increasing:
+            df = df.sort_values(date_column)
+        days = (df[date_column].to_numpy(dtype="datetime64[D]") - EPOCH).astype("int32")
+        return cls(days, {x: df[x].to_numpy() for x in df.columns if x != date_column})
+
+    def __len__(self):
+        return len(self.days)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        bytes held by the arrays, including the calendar fields computed so far.
+        """
+        arrays = [self.days, *self.values.values()]
+        arrays += [self.__dict__[x] for x in ["dates", "year", "month"] if x in self.__dict__]
+        return sum(x.nbytes for x in arrays)
+
+    @cached_property
+    def dates(self):
+        return EPOCH + self.days
+
+    @cached_property
+    def year(self):
+        return (self.dates.astype("datetime64[Y]").astype("int64") + 1970).astype("int16")
+
+    @cached_property
+    def month(self):
+        return (self.dates.astype("datetime64[M]").astype("int64") % 12 + 1).astype("int8")
+
+    def bounds(self, start=None, end=None):
+        """
+        positions first, last of the rows from start to end (both inclusive, None for open ends),
+        found by binary search on the day offsets.
+        """
+        first = 0 if start is None else int(np.searchsorted(self.days, to_day(start, round_up=True), "left"))
+        last = len(self.days) if end is None else int(np.searchsorted(self.days, to_day(end), "right"))
+        return first, max(first, last)
+
+    def to_frame(self, first: int = 0, last: int = None, date_column: str = "date"):
+        """
+        rows first to last (exclusive) as a frame with a datetime64[ns] date column and float64
+        values, the form the charts and the sync work with.
+        """
+        columns = {date_column: self.dates[first:last].astype("datetime64[ns]")}
+        columns.update((name, column[first:last].astype("float64")) for name, column in self.values.items())
+        return pd.DataFrame(columns, copy=False)
+
+    def save(self, path: str, metadata: dict = None):
+        """
+        writes the series as an uncompressed Arrow IPC file (Feather v2) with metadata in the schema,
+        to a temporary file first: processes that mapped the previous file keep reading it.
+        """
+        table = pa.table({"day": self.days, **self.values})
+        table = table.replace_schema_metadata({"series": json.dumps(metadata or {})})
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Maps a file written by save() into memory. The arrays are read-only views of the mapped file,
+        nothing is decoded or copied: the pages are read on first access and live in the page cache,
+        where all processes of the host mapping the file share them. None if there is no such file.
+        """
+        try:
+            table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+        except (OSError, pa.ArrowInvalid):
+            return None
+
+        def to_numpy(column):
+            # a table written by save() has a single chunk, its buffer is used as is
+            return column.chunk(0).to_numpy(zero_copy_only=True) if column.num_chunks == 1 else column.to_numpy()
+
+        metadata = json.loads(table.schema.metadata[b"series"])
+        values = {x: to_numpy(table.column(x)) for x in table.column_names if x != "day"}
+        return cls(to_numpy(table.column("day")), values, metadata)
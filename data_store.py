@@ -0,0 +1,474 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+import ogd_client
+from chart_cache import ChartCache
+from daily_series import DailySeries
+from partitioned_store import PartitionedStore
+from rollups import build_rollups, load_rollups, rollup, save_rollups, update_rollups
+from running_stats import build_stats, is_current, load_stats, save_stats, update_stats
+
+try:
+    import fcntl
+except ImportError:  # windows, locking between processes is not available
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+# a failed or empty sync is not repeated by any session or process within this interval
+SYNC_RETRY_INTERVAL = timedelta(minutes=15)
+# default time in seconds a sync of one dataset may take, can be set per source with "timeout"
+SYNC_TIMEOUT = 120
+# cadence of the background refresher in seconds
+REFRESH_INTERVAL = int(os.environ.get("RHEIN_REFRESH_INTERVAL", 1800))
+
+data_dict = {
+    "flow": {
+        "api_url": ogd_client.API_URL,
+        "dataset": "100089",
+        "path": "./data/flow",
+        # 10 minute values as received from data.bs, monthly partitions
+        "raw_path": "./data/flow_raw",
+        "rollups_path": "./data/flow_rollups",
+        "stats_path": "./data/flow_stats.json",
+        # daily values as memory mapped arrow file, see DailySeries.load
+        "series_path": "./data/flow.arrow",
+        "json_fields": ["timestamp", "abfluss", "pegel"],
+        "time_stamp_column": "timestamp",
+        "aggregation_par": "abfluss",
+        "aggregation_func": "mean",
+        "timeout": 120,
+    },
+    "precipitation": {
+        "api_url": ogd_client.API_URL,
+        "dataset": "100051",
+        "path": "./data/prec",
+        "rollups_path": "./data/prec_rollups",
+        "stats_path": "./data/prec_stats.json",
+        "series_path": "./data/prec.arrow",
+        "json_fields": ["datum_zeit", "prec_mm"],
+        "time_stamp_column": "datum_zeit",
+        "aggregation_par": "prec_mm",
+        "aggregation_func": "sum",
+        "timeout": 60,
+    },
+}
+
+
+def data_is_up_to_date(max_date):
+    """
+    Verifies whether now() is not more than 24 hours ahead of max_date, the most recent
+    record in the local data table.
+    """
+    diff = pd.to_datetime(datetime.today()) - pd.to_datetime(max_date)
+    result = diff < timedelta(hours=24)
+    return result
+
+
+@contextmanager
+def file_lock(path: str):
+    """
+    exclusive lock on path + '.lock', held by at most one process of the host at a time.
+    """
+    with open(path + ".lock", "a") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield lock_file
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def last_sync_attempt(path: str):
+    """
+    time of the last sync attempt of any process, recorded as modification time of path + '.synched'.
+    """
+    try:
+        return datetime.fromtimestamp(os.path.getmtime(path + ".synched"))
+    except OSError:
+        return datetime.min
+
+
+def record_sync_attempt(path: str):
+    with open(path + ".synched", "a"):
+        os.utime(path + ".synched")
+
+
+def load_local_data(source: dict):
+    return PartitionedStore(source["path"]).read()
+
+
+def extract_records(records: list, source: dict):
+    """
+    converts a page of api records into a dataframe with the columns zeit (UTC) and the value
+    fields of the source. the columns are built directly from the records in one pass and the time
+    stamps are parsed once with a fixed format. missing values become NaN.
+    """
+    ts_col = source["time_stamp_column"]
+    fields = [x["fields"] for x in records]
+    time_stamps = [x[ts_col] for x in fields]
+    if all(x.endswith("+00:00") for x in time_stamps):
+        # data.bs returns UTC time stamps, numpy parses the fixed 'YYYY-MM-DDTHH:MM:SS' prefix much faster than pandas parses the offset
+        zeit = pd.DatetimeIndex(np.array([x[:19] for x in time_stamps], dtype="datetime64[s]")).tz_localize("UTC")
+    else:
+        zeit = pd.to_datetime(time_stamps, format="ISO8601", utc=True)
+    df_ogd = pd.DataFrame({"zeit": zeit})
+    for par in source["json_fields"]:
+        if par != ts_col:
+            df_ogd[par] = np.array([x.get(par) for x in fields], dtype="float64")
+    return df_ogd
+
+
+def get_raw_store(source: dict) -> PartitionedStore:
+    return PartitionedStore(source["raw_path"], date_column="zeit", partition="month", compression="zstd")
+
+
+def to_raw_frame(df_ogd, source: dict):
+    """
+    compact form of the raw series: naive UTC time stamps in milliseconds (the parquet resolution)
+    and float32 values, 8 bytes per time stamp and 4 per value before compression.
+    """
+    value_columns = [x for x in source["json_fields"] if x != source["time_stamp_column"]]
+    df_raw = df_ogd[value_columns].astype("float32")
+    df_raw.insert(0, "zeit", df_ogd["zeit"].dt.tz_convert(None).astype("datetime64[ms]"))
+    return df_raw
+
+
+def load_raw_data(source: dict, start=None, end=None, level: str = None):
+    """
+    raw series from start to end (UTC, both inclusive), only the monthly partitions of the range are
+    read. optionally rolled up to a level of the pyramid (hour to year) with the aggregation of the
+    source, see rollups.rollup. None if the source has no raw series or there are no values in the
+    range.
+    """
+    if "raw_path" not in source:
+        return None
+    df_raw = get_raw_store(source).read(start, end)
+    if len(df_raw) == 0:
+        return None
+    if level is None:
+        return df_raw
+    value_columns = [x for x in df_raw.columns if x != "zeit"]
+    return rollup(df_raw, level, value_columns, how=source["aggregation_func"])
+
+
+def partitions_state(source: dict) -> dict:
+    """
+    number of rows and last time stamp of the partitions, as listed in the manifest.
+    """
+    partitions = PartitionedStore(source["path"]).partitions()
+    return {
+        "rows": sum(x["rows"] for x in partitions),
+        "max_date": partitions[-1]["max_date"] if len(partitions) > 0 else None,
+    }
+
+
+def save_series(source: dict, df) -> DailySeries:
+    """
+    writes the daily values df, as just written to the partitions, to the series file and maps it.
+    """
+    DailySeries.from_frame(df).save(source["series_path"], partitions_state(source))
+    return DailySeries.load(source["series_path"])
+
+
+def load_dataset(source: dict):
+    """
+    daily values, rollup pyramid and running statistics of a dataset. the daily values are mapped
+    from the series file, the partitions are only read if the series file, the pyramid or the
+    statistics are missing or do not match the partitions, e.g. after running prep_data.py. these
+    are then rebuilt.
+    """
+    df = None
+    series = DailySeries.load(source["series_path"])
+    if series is None or series.metadata != partitions_state(source):
+        df = load_local_data(source)
+        series = save_series(source, df)
+    max_date = pd.Timestamp(series.dates[-1])
+    rollups = load_rollups(source["rollups_path"])
+    if rollups is None or rollups["day"]["zeit"].max() != max_date:
+        df = load_local_data(source) if df is None else df
+        rollups = build_rollups(df, source["aggregation_par"], load_raw_data(source))
+        save_rollups(source["rollups_path"], rollups)
+    stats = load_stats(source["stats_path"])
+    if not is_current(stats, max_date):
+        df = load_local_data(source) if df is None else df
+        stats = build_stats(df, source["aggregation_par"])
+        save_stats(source["stats_path"], stats)
+    return series, rollups, stats
+
+
+def load_checkpoint(source: dict, since: str):
+    """
+    returns the cursor and the daily sums and counts of an interrupted catch-up starting at since,
+    or since and no days if there is none.
+    """
+    try:
+        with open(source["path"] + ".checkpoint.json") as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return since, {}
+    if checkpoint["since"] != since:
+        return since, {}
+    return checkpoint["cursor"], checkpoint["days"]
+
+
+def save_checkpoint(source: dict, since: str, cursor: str, days: dict):
+    path = source["path"] + ".checkpoint.json"
+    with open(path + ".tmp", "w") as f:
+        json.dump({"since": since, "cursor": cursor, "days": days}, f)
+    os.replace(path + ".tmp", path)
+
+
+def synch_local_data(source: dict, df_local, deadline: float = None):
+    """
+    fetches all records since the start of the most recent local day page by page and adds them
+    to daily sums and counts, so only one page is held in memory. progress is checkpointed after
+    each page, a catch-up that is interrupted or runs past the deadline (time.monotonic()) resumes
+    at the last page on the next sync.
+    """
+
+    def add_to_days(df_ogd, days):
+        agg_par = source["aggregation_par"]
+        df_day = df_ogd.groupby(df_ogd["zeit"].dt.floor("D"))[agg_par].agg(["sum", "count"])
+        for day, day_sum, day_count in zip(df_day.index.strftime("%Y-%m-%d"), df_day["sum"], df_day["count"]):
+            previous_sum, previous_count = days.get(day, (0.0, 0))
+            days[day] = (previous_sum + float(day_sum), previous_count + int(day_count))
+
+    def get_daily_values(days):
+        agg_par = source["aggregation_par"]
+        df_ogd = pd.DataFrame(
+            [(day, day_sum, day_count) for day, (day_sum, day_count) in days.items() if day_count > 0],
+            columns=["date", "sum", "count"],
+        )
+        df_ogd["date"] = pd.to_datetime(df_ogd["date"])
+        if source["aggregation_func"] == "mean":
+            df_ogd[agg_par] = df_ogd["sum"] / df_ogd["count"]
+        else:
+            df_ogd[agg_par] = df_ogd["sum"]
+        return df_ogd[["date", agg_par]].sort_values("date")
+
+    def combine_local_remote_data(df_new_data, df_old_data):
+        """
+        remove last day of local data and add new data, then save the partitions from the year of
+        the removed day on. returns the combined data, or the unchanged local data if nothing new
+        was found. a failed write raises, the checkpoint and the validators are then kept and the
+        sync is retried.
+        """
+        df_old_data = df_old_data[df_old_data["date"] < df_old_data["date"].max()]
+        # save data if df_ogd has data, meaning that more recent data was discovered
+        df_new_data = df_new_data[df_new_data["date"] > df_old_data["date"].max()]
+        if len(df_new_data) == 0:
+            return df_local
+        df = pd.concat([df_old_data, df_new_data], ignore_index=True)
+        PartitionedStore(source["path"]).write(df, start=df_local["date"].max())
+        return df
+
+    if not ogd_client.dataset_modified(source, deadline):
+        return df_local
+    since = df_local["date"].max().strftime("%Y-%m-%dT00:00:00Z")
+    cursor, days = load_checkpoint(source, since)
+    ts_col = source["time_stamp_column"]
+    for records in ogd_client.fetch_pages(source, cursor, inclusive=cursor == since, deadline=deadline):
+        df_ogd = extract_records(records, source)
+        if "raw_path" in source:
+            get_raw_store(source).append(to_raw_frame(df_ogd, source))
+        add_to_days(df_ogd, days)
+        save_checkpoint(source, since, records[-1]["fields"][ts_col], days)
+    if len(days) == 0:
+        ogd_client.mark_synchronised(source)
+        return df_local
+    df = combine_local_remote_data(get_daily_values(days), df_local)
+    os.remove(source["path"] + ".checkpoint.json")
+    ogd_client.mark_synchronised(source)
+    return df
+
+
+class Snapshot():
+    """
+    Read-only, versioned state of one dataset. A sync never modifies a published snapshot, it
+    publishes a new one, so a session can keep rendering the snapshot it started with.
+    """
+
+    def __init__(self, series: DailySeries, rollups: dict, version: int, mtime: float, stats: dict = None):
+        # daily values in compact form, frames are only built for the rows a caller asks for
+        self.series = series
+        # rollup pyramid, see rollups.build_rollups
+        self.rollups = rollups
+        # running statistics of the daily values, see running_stats.build_stats
+        self.stats = stats
+        self.version = version
+        # modification time of the manifest of the partitions the snapshot was read from or written to
+        self.mtime = mtime
+        self.created = datetime.now()
+
+    @property
+    def min_date(self):
+        return pd.Timestamp(self.series.dates[0])
+
+    @property
+    def max_date(self):
+        return pd.Timestamp(self.series.dates[-1])
+
+    def between(self, start=None, end=None):
+        """
+        rows from start to end (both inclusive, None for open ends). the bounds are found by binary
+        search on the sorted day offsets, only the rows in the range are converted to a frame.
+        """
+        return self.series.to_frame(*self.series.bounds(start, end))
+
+    def day(self, day):
+        """
+        rows of one day, empty if there is no value for the day.
+        """
+        return self.between(day, day)
+
+
+class DataStore():
+    """
+    Holds one snapshot per dataset in sources (data_dict by default) and is shared by all sessions
+    of the process. A dataset is loaded on first access, so creating the store does no I/O. Page
+    renders only read snapshots, syncing is left to the Refresher.
+    """
+
+    def __init__(self, sources: dict = data_dict):
+        self.sources = sources
+        self._lock = threading.Lock()
+        self._load_locks = {key: threading.Lock() for key in sources}
+        self._sync_locks = {key: threading.Lock() for key in sources}
+        self._snapshots = {}
+        # specs of the charts rendered from the snapshots, keyed by snapshot version
+        self.charts = ChartCache()
+
+    def get(self, key: str) -> Snapshot:
+        """
+        current snapshot of a dataset. the first access loads it, concurrent first accesses wait
+        for this load instead of loading again.
+        """
+        snapshot = self._snapshots.get(key)
+        if snapshot is None:
+            with self._load_locks[key]:
+                if key not in self._snapshots:
+                    self.publish(key, *load_dataset(self.sources[key]))
+                snapshot = self._snapshots[key]
+        return snapshot
+
+    def max_date(self, key: str):
+        """
+        last day of a dataset, from its snapshot if it is loaded, else from the manifest of the
+        partitions, so checking for stale data does not load a dataset.
+        """
+        snapshot = self._snapshots.get(key)
+        if snapshot is not None:
+            return snapshot.max_date
+        return partitions_state(self.sources[key])["max_date"]
+
+    def publish(self, key: str, series: DailySeries, rollups: dict, stats: dict = None):
+        """
+        replaces the snapshot of a dataset in a single assignment, readers see either the old
+        or the new snapshot, never a partial one.
+        """
+        mtime = PartitionedStore(self.sources[key]["path"]).mtime()
+        with self._lock:
+            previous = self._snapshots.get(key)
+            version = previous.version + 1 if previous else 1
+            self._snapshots[key] = Snapshot(series, rollups, version, mtime, stats)
+
+    def refresh(self):
+        """
+        synchronises all datasets that are not up to date with data.bs concurrently and publishes
+        the results. the refresh takes as long as the slowest dataset: every request of a sync ends
+        by the deadline set by the source's timeout, a sync running past it is stopped and resumed
+        from its checkpoint by the next refresh. a failed sync is logged and does not stop the
+        syncs of the other datasets.
+        """
+        stale_keys = [key for key in self.sources if not data_is_up_to_date(self.max_date(key))]
+        if len(stale_keys) == 0:
+            return
+        with ThreadPoolExecutor(max_workers=len(stale_keys), thread_name_prefix="rhein-synch") as executor:
+            futures = {key: executor.submit(self.synch, key) for key in stale_keys}
+        for key, future in futures.items():
+            if future.exception() is not None:
+                logger.error(f"Synchronisation von {key} fehlgeschlagen", exc_info=future.exception())
+
+    def synch(self, key: str):
+        """
+        single-flight sync of one dataset: threads of this process queue on a lock, processes on
+        a file lock. whoever gets the lock first fetches and writes, the others find the fresh
+        file or the recent attempt and return without a request. if the sync fails, the last
+        snapshot stays published. if it fails after the partitions were written, the partitions
+        are newer than the snapshot and the next sync reloads them, rebuilding the series, rollups
+        and statistics.
+        """
+        source = self.sources[key]
+        path = source["path"]
+        with self._sync_locks[key], file_lock(path):
+            # another process may have written the data while we were waiting
+            if PartitionedStore(path).mtime() > self.get(key).mtime:
+                self.publish(key, *load_dataset(source))
+            snapshot = self.get(key)
+            if data_is_up_to_date(snapshot.max_date) or datetime.now() - last_sync_attempt(path) < SYNC_RETRY_INTERVAL:
+                return
+            # the snapshot holds float32 values, the partitions are rewritten from the stored values
+            df = load_local_data(source)
+            deadline = time.monotonic() + source.get("timeout", SYNC_TIMEOUT)
+            try:
+                df_synched = synch_local_data(source, df, deadline)
+                if df_synched is not df:
+                    # only the buckets from the replaced last day on change
+                    start = df["date"].max()
+                    rollups = update_rollups(
+                        snapshot.rollups, df_synched, source["aggregation_par"], start, load_raw_data(source, start)
+                    )
+                    save_rollups(source["rollups_path"], rollups)
+                    # the statistics only take up the days closed since the last sync
+                    stats = update_stats(snapshot.stats, df_synched, source["aggregation_par"])
+                    save_stats(source["stats_path"], stats)
+                    self.publish(key, save_series(source, df_synched), rollups, stats)
+            except Exception:
+                logger.exception(f"Synchronisation von {key} fehlgeschlagen")
+            finally:
+                record_sync_attempt(path)
+
+
+class Refresher(threading.Thread):
+    """
+    Background thread that calls store.refresh() every interval seconds, starting immediately.
+    """
+
+    def __init__(self, store: DataStore, interval: float = REFRESH_INTERVAL):
+        super().__init__(name="rhein-refresher", daemon=True)
+        self.store = store
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.store.refresh()
+            except Exception:
+                logger.exception("Aktualisierung der Daten fehlgeschlagen")
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+
+
+@st.cache_resource(show_spinner=False)
+def get_data_store() -> DataStore:
+    """
+    creates the store and starts its refresher, once per process. a dataset is loaded by the first
+    view that needs it or by the first sync that updates it.
+    """
+    store = DataStore()
+    Refresher(store).start()
+    return store
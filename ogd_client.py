@@ -0,0 +1,140 @@
+import threading
+import time
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# base url of the data.bs api, a source can point to another server with "api_url"
+API_URL = "https://data.bs.ch/api/"
+PAGE_SIZE = 1000
+# connect and read timeout in seconds
+TIMEOUT = (5, 30)
+# failed requests are retried with exponential backoff (1, 2, 4 s)
+RETRIES = 3
+BACKOFF = 1
+RETRY_STATUS = [429, 500, 502, 503, 504]
+
+
+def create_session():
+    """
+    keep-alive session with a connection pool shared by all fetchers, see get() for the retries.
+    """
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+session = create_session()
+# validators (ETag, Last-Modified) of the dataset metadata, per dataset
+_validators = {}
+_received_validators = {}
+_validators_lock = threading.Lock()
+
+
+def time_left(deadline: float, url: str) -> float:
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise TimeoutError(f"{url}: deadline exceeded")
+    return left
+
+
+def get(url: str, deadline: float = None, **kwargs):
+    """
+    GET with the pooled session, retrying connection errors, timeouts and the status codes in
+    RETRY_STATUS. With a deadline (time.monotonic()) the connect and read timeouts of every attempt
+    are shortened to the time left and no attempt or backoff reaches past the deadline, a request
+    that does not complete in time raises TimeoutError.
+    """
+    for attempt in range(RETRIES + 1):
+        timeout = TIMEOUT
+        if deadline is not None:
+            left = time_left(deadline, url)
+            timeout = tuple(min(x, left) for x in TIMEOUT)
+        try:
+            response = session.get(url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == RETRIES:
+                raise
+        else:
+            if response.status_code not in RETRY_STATUS or attempt == RETRIES:
+                return response
+        backoff = BACKOFF * 2**attempt
+        if deadline is not None and time_left(deadline, url) <= backoff:
+            raise TimeoutError(f"{url}: deadline exceeded")
+        time.sleep(backoff)
+
+
+def dataset_modified(source: dict, deadline: float = None) -> bool:
+    """
+    Conditional request for the metadata of a dataset. Returns False if data.bs answers 304, i.e.
+    the dataset has not changed since the last call of mark_synchronised, so a refresh check costs
+    one small round-trip instead of fetching records. Raises TimeoutError if there is no answer
+    by the deadline (time.monotonic()).
+    """
+    dataset = source["dataset"]
+    headers = {}
+    with _validators_lock:
+        validators = _validators.get(dataset, {})
+    if "ETag" in validators:
+        headers["If-None-Match"] = validators["ETag"]
+    if "Last-Modified" in validators:
+        headers["If-Modified-Since"] = validators["Last-Modified"]
+    url = f"{source.get('api_url', API_URL)}explore/v2.1/catalog/datasets/{dataset}"
+    response = get(url, deadline, headers=headers)
+    if response.status_code == 304:
+        return False
+    response.raise_for_status()
+    with _validators_lock:
+        _received_validators[dataset] = {
+            key: response.headers[key] for key in ["ETag", "Last-Modified"] if key in response.headers
+        }
+    return True
+
+
+def mark_synchronised(source: dict):
+    """
+    the validators received by the last dataset_modified call become the condition of the next one.
+    only called after a successful sync, so a failed sync is retried even if the dataset is unchanged.
+    """
+    dataset = source["dataset"]
+    with _validators_lock:
+        if dataset in _received_validators:
+            _validators[dataset] = _received_validators.pop(dataset)
+
+
+def fetch_pages(source: dict, cursor: str, inclusive: bool = True, page_size: int = PAGE_SIZE, deadline: float = None):
+    """
+    Generator of record pages of a data.bs dataset, oldest first, starting at the time stamp cursor
+    and ending at the current time (the datasets contain forecast records until 2050). Each page
+    continues after the last time stamp of the previous page instead of using an offset, so there
+    is no limit on the number of records and a catch-up can be resumed from the last time stamp seen.
+    Records sharing the time stamp of a page boundary would be skipped, the time stamps of the
+    datasets are unique. Raises TimeoutError if the pages are not received by the deadline
+    (time.monotonic()), the pages yielded so far can be kept.
+    """
+    ts_col = source["time_stamp_column"]
+    url = f"{source.get('api_url', API_URL)}records/1.0/search/"
+    until = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    while True:
+        operator = ">=" if inclusive else ">"
+        params = {
+            "dataset": source["dataset"],
+            "q": f'{ts_col}{operator}"{cursor}" AND {ts_col}<="{until}"',
+            "rows": page_size,
+            # ascending, the api sorts descending by default
+            "sort": f"-{ts_col}",
+            "fields": ",".join(source["json_fields"]),
+        }
+        response = get(url, deadline, params=params)
+        response.raise_for_status()
+        records = response.json()["records"]
+        if len(records) == 0:
+            return
+        yield records
+        if len(records) < page_size:
+            return
+        cursor = records[-1]["fields"][ts_col]
+        inclusive = False
@@ -0,0 +1,120 @@
+import json
+import os
+
+import pandas as pd
+
+# partition key formats, partitions hold the rows of one year or one month
+partition_formats = {"year": "%Y", "month": "%Y-%m"}
+
+
+def write_parquet_atomic(df, path: str, **kwargs):
+    """
+    writes to a temporary file first and renames it, readers never see a partly written file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.to_parquet(tmp_path, index=False, **kwargs)
+    os.replace(tmp_path, path)
+
+
+class PartitionedStore():
+    """
+    Time series stored as one parquet file per year or month in a directory. manifest.json lists the
+    partitions with their first and last time stamp and number of rows, e.g.
+    {"partitions": {"2023": {"file": "2023.pq", "min_date": "2023-01-01T00:00:00", "max_date": "2023-11-18T00:00:00", "rows": 322}}}.
+    A sync only rewrites the partitions it changed, readers skip the partitions outside the
+    requested range. Time stamps are naive, the raw series are stored in UTC.
+    """
+
+    def __init__(self, path: str, date_column: str = "date", partition: str = "year", compression: str = "snappy"):
+        self.path = path
+        self.date_column = date_column
+        self.key_format = partition_formats[partition]
+        self.compression = compression
+        self.manifest_file = os.path.join(path, "manifest.json")
+
+    def manifest(self) -> dict:
+        try:
+            with open(self.manifest_file) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"partitions": {}}
+
+    def mtime(self) -> float:
+        return os.path.getmtime(self.manifest_file)
+
+    def partitions(self, start=None, end=None) -> list:
+        """
+        manifest entries of the partitions overlapping the range start..end (both inclusive), in time order.
+        """
+        result = []
+        for key, partition in sorted(self.manifest()["partitions"].items()):
+            if start is not None and pd.Timestamp(partition["max_date"]) < pd.Timestamp(start):
+                continue
+            if end is not None and pd.Timestamp(partition["min_date"]) > pd.Timestamp(end):
+                continue
+            result.append(partition)
+        return result
+
+    def read(self, start=None, end=None):
+        """
+        returns the rows from start to end (both inclusive, None for open ends), sorted by time.
+        """
+        partitions = self.partitions(start, end)
+        frames = [pd.read_parquet(os.path.join(self.path, x["file"])) for x in partitions]
+        if len(frames) == 0:
+            return pd.DataFrame(columns=[self.date_column])
+        df = pd.concat(frames, ignore_index=True)
+        df[self.date_column] = pd.to_datetime(df[self.date_column])
+        if start is not None:
+            df = df[df[self.date_column] >= pd.Timestamp(start)]
+        if end is not None:
+            df = df[df[self.date_column] <= pd.Timestamp(end)]
+        return df.reset_index(drop=True)
+
+    def write(self, df, start=None):
+        """
+        writes the rows of df into the partitions. only the partitions from the one holding start
+        on are rewritten, df must hold all rows of these partitions.
+        """
+        keys = pd.to_datetime(df[self.date_column]).dt.strftime(self.key_format)
+        if start is not None:
+            df = df[keys >= pd.Timestamp(start).strftime(self.key_format)]
+            keys = keys[df.index]
+        self._write_partitions(df.groupby(keys))
+
+    def append(self, df):
+        """
+        merges the rows of df into the existing partitions, rows with a time stamp already stored
+        replace the stored ones. only the partitions df falls into are read and rewritten.
+        """
+        manifest = self.manifest()
+        keys = pd.to_datetime(df[self.date_column]).dt.strftime(self.key_format)
+        groups = []
+        for key, df_new in df.groupby(keys):
+            if key in manifest["partitions"]:
+                df_old = pd.read_parquet(os.path.join(self.path, manifest["partitions"][key]["file"]))
+                df_new = pd.concat([df_old, df_new], ignore_index=True)
+                df_new = df_new.drop_duplicates(subset=self.date_column, keep="last")
+            groups.append((key, df_new))
+        self._write_partitions(groups)
+
+    def _write_partitions(self, groups):
+        """
+        writes (key, rows) pairs as partitions, then replaces the manifest.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        manifest = self.manifest()
+        for key, df_partition in groups:
+            df_partition = df_partition.sort_values(self.date_column)
+            file = f"{key}.pq"
+            write_parquet_atomic(df_partition, os.path.join(self.path, file), compression=self.compression)
+            manifest["partitions"][key] = {
+                "file": file,
+                "min_date": df_partition[self.date_column].min().strftime("%Y-%m-%dT%H:%M:%S"),
+                "max_date": df_partition[self.date_column].max().strftime("%Y-%m-%dT%H:%M:%S"),
+                "rows": len(df_partition),
+            }
+        tmp_file = f"{self.manifest_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(tmp_file, self.manifest_file)
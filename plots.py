@@ -10,19 +10,58 @@ import config
 from datetime import datetime, timedelta
 import tools
 import config as cn
+from time_index import TimeIndex, calendar_codes
+from aggregation import aggregate_groups
+from cubes import box_cube, box_lookup, heatmap_cube, heatmap_means
 from locale import setlocale, LC_ALL
 
 plot_width = 800
 plot_height = 300
+# calendar keys of tools.add_time_columns the plots group on, kept as small integer codes
+calendar_columns = ["jahr", "monat", "woche", "tag", "stunde"]
+
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def get_time_index(_df_data, version) -> TimeIndex:
+    """
+    the data with its calendar columns, sorted by zeit. computed once per data version and shared
+    by all sessions, the frame must not be modified. month names are only mapped onto the
+    aggregated rows of a plot.
+    """
+    df = calendar_codes(tools.add_time_columns(_df_data), calendar_columns)
+    return TimeIndex(df)
+
+
+@st.cache_resource(max_entries=16, show_spinner=False)
+def get_heatmap_cube(_df_data, version, x, y, parameters: tuple) -> dict:
+    """
+    heatmap cube of all parameters for the cells (x, y), once per data version, see cubes.heatmap_cube.
+    """
+    return heatmap_cube(_df_data, x, y, list(parameters))
+
+
+@st.cache_resource(max_entries=16, show_spinner=False)
+def get_box_cube(_df_data, version, x, base, parameters: tuple) -> dict:
+    """
+    boxplots of all parameters per x, once per data version, see cubes.box_cube.
+    """
+    return box_cube(_df_data, x, list(parameters), base)
 
 
 class App:
-    """ """
+    """
+    analysis view of df_data. version identifies the contents of df_data, e.g. the modification
+    time of the file it was read from, and keys the caches shared by all sessions: frames with
+    other values must be passed with another version.
+    """
 
-    def __init__(self, df_data, df_stations, df_parameters):
+    def __init__(self, df_data, df_stations, df_parameters, version):
         setlocale(LC_ALL, "de_CH")  # shows the month names in german
         self.df_parameters = df_parameters
-        self.df_data = tools.add_time_columns(df_data)
+        # sorted by zeit, filter_data slices it by binary search
+        self.version = version
+        self.time_index = get_time_index(df_data, self.version)
+        self.df_data = self.time_index.df
         self.df_stations = df_stations
         self.dic_stations = df_stations["name"].to_dict()
         self.station = {}
@@ -392,30 +431,66 @@ class App:
         plot_keys = [x for x in self.plot_type_def.keys()]
         self.plot_type_options = dict(zip(plot_keys, plot_legends))
 
-    def filter_data(self):
-        df = self.df_data
+    def get_year_range(self):
+        """
+        selected years as (first year, end year), the end year is excluded. None if the selection
+        spans all years.
+        """
+        if "years" not in self.settings:
+            return None
+        if (
+            self.settings["years"][0] == self.start_jahr
+            and self.settings["years"][1] == self.end_jahr
+        ):
+            return None
+        return self.settings["years"][0], self.settings["years"][1]
+
+    def split_parameters(self, df, column: str = "variable"):
+        """
+        rows of each selected parameter of a long frame holding the values of all parameters, as
+        (parameter, frame) in the order of the selection. the frame is split once, not filtered
+        per parameter.
+        """
+        groups = dict(tuple(df.groupby(column, sort=False)))
+        return [
+            (par, groups[par].reset_index(drop=True))
+            for par in self.settings["parameters"]
+            if par in groups
+        ]
 
+    def show_charts(self, charts):
+        """
+        shows the charts of the parameters one below the other as a single chart spec, each with
+        its own y axis and colors.
+        """
+        if len(charts) == 1:
+            st.altair_chart(charts[0])
+        else:
+            st.altair_chart(
+                alt.vconcat(*charts).resolve_scale(y="independent", color="independent")
+            )
+
+    def show_table(self, df):
+        with st.beta_expander("Data"):
+            AgGrid(df)
+            st.markdown(tools.get_table_download_link(df), unsafe_allow_html=True)
+
+    def filter_data(self):
+        """
+        rows of the selected date and year range, as a slice of df_data (no copy). the bounds of
+        the ranges are found by binary search on zeit.
+        """
+        first, last = 0, len(self.df_data)
         if "date_from" in self.settings:
-            start_series = self.df_data["datum"].min().to_pydatetime().date()
-            end_series = self.df_data["datum"].max().to_pydatetime().date()
-            if (
-                self.settings["date_from"] > start_series
-                or self.settings["date_to"] < end_series
-            ):
-                df = df[
-                    (df["zeit"].dt.date >= self.settings["date_from"])
-                    & (df["zeit"].dt.date <= self.settings["date_to"])
-                ]
-        if "years" in self.settings:
-            if (
-                self.settings["years"][0] != self.start_jahr
-                or self.settings["years"][1] != self.end_jahr
-            ):
-                df = df[
-                    df["jahr"].isin(
-                        range(self.settings["years"][0], self.settings["years"][1])
-                    )
-                ]
+            start, end = self.time_index.date_bounds(
+                self.settings["date_from"], self.settings["date_to"]
+            )
+            first, last = max(first, start), min(last, end)
+        years = self.get_year_range()
+        if years is not None:
+            start, end = self.time_index.year_bounds(years[0], years[1])
+            first, last = max(first, start), min(last, end)
+        df = self.time_index.slice(first, last)
         if self.settings["agg_time"] == "Monat-Stunde":
             df = df[df["monat"] == self.settings["monat"]]
         return df
@@ -492,29 +567,34 @@ class App:
                 text += " Um die Übersichtlichkeit bei den Extremwerten zu wahren, wurden die stündlichen Messungen zu Tageswerten aggregiert."
             return text
 
-        def prepare_data(df, par):
-            par_title = par.replace(
-                ".", ""
-            )  # remove dot, as it cannot be displayed in aggrid
-            # df['monat'] = df['monat'].replace(config.MONTHS_DICT)
-            t_agg = t_agg = self.settings["agg_time"]
-            if t_agg["base_values_agg"] != None:
-                df = df.groupby([t_agg["col"], t_agg["base_values_agg"]])[par].agg(
-                    ["mean"]
-                )
-                df = df.rename(columns={"mean": par_title}).reset_index()
-            else:
-                df = df.rename(columns={par: par_title}).reset_index()
-            df = df[[par_title, t_agg["col"]]]
-            df = df.rename(columns={par: par_title})
-            df["Legende"] = par
+        def prepare_data():
+            t_agg = self.settings["agg_time"]
+            # the boxes of all selected parameters are looked up in the cube of the data version
+            # instead of being computed from the rows of the selected years
+            cube = get_box_cube(
+                self.df_data,
+                self.version,
+                t_agg["col"],
+                t_agg["base_values_agg"],
+                tuple(self.lst_parameters),
+            )
+            df, df_outliers = box_lookup(
+                cube,
+                t_agg["col"],
+                self.settings["parameters"],
+                self.get_year_range(),
+                t_agg["base_values_agg"],
+            )
+            df = df.rename(columns={"variable": "Legende"})
+            df_outliers = df_outliers.rename(columns={"variable": "Legende"})
             if t_agg["col"] == "monat":
                 df = df.replace({"monat": cn.MONTHS_DICT})
+                df_outliers = df_outliers.replace({"monat": cn.MONTHS_DICT})
 
-            return df, par_title
+            return df, df_outliers
 
         def prepare_plot(df, par, par_title):
-            t_agg = t_agg = self.settings["agg_time"]
+            t_agg = self.settings["agg_time"]
             self.settings["lines"], legend_colors = self.get_lines(par)
             self.settings[
                 "plot_title"
@@ -539,53 +619,70 @@ class App:
                     axis=alt.Axis(title=t_agg["agg_interval"]),
                     sort=list(cn.MONTHS_REV_DICT.keys()),
                 )
-            self.settings["y"] = alt.Y(f"{par_title}:Q")
+            self.settings["y"] = alt.Y("lower:Q", axis=alt.Axis(title=par_title))
+            self.settings["outlier_y"] = alt.Y(f"{par_title}:Q")
             self.settings["color"] = alt.Color(
                 "Legende:N",
                 scale=alt.Scale(range=legend_colors),
             )
             return (df,)
 
-        def show_plot(df):
+        def get_chart(df, df_outliers):
+            # the boxes are drawn from their summaries, as mark_boxplot would draw them from the values:
+            # whiskers, box from q1 to q3, median tick and the outliers as open circles
+            boxes = alt.Chart(df).encode(
+                x=self.settings["x"],
+                color=self.settings["color"],
+                tooltip=self.settings["tooltip"],
+            )
             chart = (
-                alt.Chart(df)
-                .mark_boxplot()
+                boxes.mark_rule().encode(y=self.settings["y"], y2="upper:Q")
+                + boxes.mark_bar(size=14).encode(y="q1:Q", y2="q3:Q")
+                + boxes.mark_tick(color="white", size=14, orient="horizontal").encode(
+                    y="median:Q"
+                )
+                + alt.Chart(df_outliers)
+                .mark_point()
                 .encode(
                     x=self.settings["x"],
-                    y=self.settings["y"],
+                    y=self.settings["outlier_y"],
                     color=self.settings["color"],
-                    tooltip=self.settings["tooltip"],
                 )
             )
 
             if self.settings["show_guidelines"]:
                 for line in self.settings["lines"]:
                     chart += line
-            st.altair_chart(
-                chart.properties(
-                    width=plot_width,
-                    height=plot_height,
-                    title=self.settings["plot_title"],
-                )
+            return chart.properties(
+                width=plot_width,
+                height=plot_height,
+                title=self.settings["plot_title"],
             )
 
         self.get_settings(
             self.settings["agg_time"]["settings"], self.settings["agg_time"]["defaults"]
         )
-        for par in self.settings["parameters"]:
-            df = self.filter_data()
-            df, par_title = prepare_data(df, par)
-            if len(df) > 0:
-                prepare_plot(df, par, par_title)
-                show_plot(df)
-                st.markdown(get_text(df, par, par_title))
-                with st.beta_expander("Data"):
-                    AgGrid(df)
-                    st.markdown(
-                        tools.get_table_download_link(df), unsafe_allow_html=True
-                    )
-            else:
-                st.warning("Es wurden mit den Filtereinstellungen keine Werte gefunden")
+        if len(self.settings["parameters"]) == 0:
+            return
+        df, df_outliers = prepare_data()
+        outliers = dict(self.split_parameters(df_outliers, "Legende"))
+        charts, texts = [], []
+        for par, df_par in self.split_parameters(df, "Legende"):
+            par_title = par.replace(
+                ".", ""
+            )  # remove dot, as it cannot be displayed in aggrid
+            df_par_outliers = outliers.get(par, df_outliers.iloc[:0])
+            df_par_outliers = df_par_outliers.rename(columns={"value": par_title})
+            prepare_plot(df_par, par, par_title)
+            charts.append(get_chart(df_par, df_par_outliers))
+            texts.append(get_text(df_par, par, par_title))
+        if len(charts) > 0:
+            self.show_charts(charts)
+            for text in texts:
+                st.markdown(text)
+            self.show_table(df)
+        else:
+            st.warning("Es wurden mit den Filtereinstellungen keine Werte gefunden")
 
     def show_linechart(self):
         def get_text(df, par):
@@ -625,31 +722,17 @@ class App:
             )
             return text
 
-        def prepare_data(df, par):
-            par_title = par.replace(
-                ".", ""
-            )  # remove dot, as it cannot be displayed in aggrid
+        def prepare_data(df):
             t_agg = self.settings["agg_time"]
-            df = df.melt(id_vars=[t_agg["col"]], value_vars=par)
-            if self.settings["show_band"]:
-                df = (
-                    df.groupby([t_agg["col"], "variable"])["value"]
-                    .agg(["mean", tools.percentile(5), tools.percentile(95)])
-                    .reset_index()
-                )
-            else:
-                df = (
-                    df.groupby([t_agg["col"], "variable"])["value"]
-                    .agg(
-                        [
-                            "mean",
-                        ]
-                    )
-                    .reset_index()
-                )
+            # mean and the 5% and 95% percentiles of the band of all selected parameters, the
+            # groups are found once for all of them
+            quantiles = (5, 95) if self.settings["show_band"] else ()
+            df = aggregate_groups(
+                df, [t_agg["col"]], self.settings["parameters"], quantiles
+            )
 
             df = df.rename(columns={"variable": "Legende", "mean": "Wert"})
-            return df, par_title
+            return df
 
         def prepare_plot(df, par, par_title):
             t_agg = self.settings["agg_time"]
@@ -681,7 +764,7 @@ class App:
             )
             self.settings["y_par"] = par
 
-        def show_plot(df):
+        def get_chart(df):
             chart = (
                 alt.Chart(df)
                 .mark_line()
@@ -714,26 +797,29 @@ class App:
             if self.settings["show_guidelines"]:
                 for line in self.settings["lines"]:
                     chart += line
-            st.altair_chart(chart)
+            return chart
 
         self.get_settings(
             self.settings["agg_time"]["settings"], self.settings["agg_time"]["defaults"]
         )
-
-        for par in self.settings["parameters"]:
-            df = self.filter_data()
-            df, par_title = prepare_data(df, par)
-            if len(df) > 0:
-                prepare_plot(df, par, par_title)
-                show_plot(df)
-                st.markdown(get_text(df, par))
-                with st.beta_expander("Data"):
-                    AgGrid(df)
-                    st.markdown(
-                        tools.get_table_download_link(df), unsafe_allow_html=True
-                    )
-            else:
-                st.warning("Es wurden mit den Filtereinstellungen keine Werte gefunden")
+        if len(self.settings["parameters"]) == 0:
+            return
+        df = prepare_data(self.filter_data())
+        charts, texts = [], []
+        for par, df_par in self.split_parameters(df, "Legende"):
+            par_title = par.replace(
+                ".", ""
+            )  # remove dot, as it cannot be displayed in aggrid
+            prepare_plot(df_par, par, par_title)
+            charts.append(get_chart(df_par))
+            texts.append(get_text(df_par, par))
+        if len(charts) > 0:
+            self.show_charts(charts)
+            for text in texts:
+                st.markdown(text)
+            self.show_table(df)
+        else:
+            st.warning("Es wurden mit den Filtereinstellungen keine Werte gefunden")
 
     def show_barchart(self):
         def get_text(df, par, par_title):
@@ -772,19 +858,14 @@ class App:
             )
             return text
 
-        def prepare_data(df, par):
-            par_title = par.replace(
-                ".", ""
-            )  # remove dot, as it cannot be displayed in aggrid
+        def prepare_data(df):
             t_agg = self.settings["agg_time"]
-            df = df.groupby(t_agg["col"])[par].agg(["mean"])
-            df = df.rename(columns={"mean": par_title})
-            df["Legende"] = t_agg["legend"]
-            df = df.reset_index()
+            # means of all selected parameters, the groups are found once for all of them
+            df = aggregate_groups(df, [t_agg["col"]], self.settings["parameters"])
             if t_agg["col"] == "monat":
                 df = df.replace({"monat": cn.MONTHS_DICT})
 
-            return df, par_title
+            return df
 
         def prepare_plot(df, par, par_title):
             t_agg = self.settings["agg_time"]
@@ -824,7 +905,7 @@ class App:
 
             # self.settings['x_scale'] = (1,23)
 
-        def show_plot(df):
+        def get_chart(df):
             chart = (
                 alt.Chart(df)
                 .mark_bar(clip=True, width=self.settings["bar_width"])
@@ -838,32 +919,35 @@ class App:
             if self.settings["show_guidelines"]:
                 for line in self.settings["lines"]:
                     chart += line
-            st.altair_chart(
-                chart.properties(
-                    width=plot_width,
-                    height=plot_height,
-                    title=self.settings["plot_title"],
-                )
-            )  # .resolve_scale(color='independent')
+            return chart.properties(
+                width=plot_width,
+                height=plot_height,
+                title=self.settings["plot_title"],
+            )
 
         self.get_settings(
             self.settings["agg_time"]["settings"], self.settings["agg_time"]["defaults"]
         )
-
-        for par in self.settings["parameters"]:
-            df = self.filter_data()
-            df, par_title = prepare_data(df, par)
-            if len(df) > 0:
-                prepare_plot(df, par, par_title)
-                show_plot(df)
-                st.markdown(get_text(df, par, par_title))
-                with st.beta_expander("Data"):
-                    AgGrid(df)
-                    st.markdown(
-                        tools.get_table_download_link(df), unsafe_allow_html=True
-                    )
-            else:
-                st.warning("Es wurden mit den Filtereinstellungen keine Werte gefunden")
+        if len(self.settings["parameters"]) == 0:
+            return
+        df = prepare_data(self.filter_data())
+        charts, texts = [], []
+        for par, df_par in self.split_parameters(df):
+            par_title = par.replace(
+                ".", ""
+            )  # remove dot, as it cannot be displayed in aggrid
+            df_par = df_par.drop(columns="variable").rename(columns={"mean": par_title})
+            df_par["Legende"] = self.settings["agg_time"]["legend"]
+            prepare_plot(df_par, par, par_title)
+            charts.append(get_chart(df_par))
+            texts.append(get_text(df_par, par, par_title))
+        if len(charts) > 0:
+            self.show_charts(charts)
+            for text in texts:
+                st.markdown(text)
+            self.show_table(df.rename(columns={"variable": "Parameter", "mean": "Wert"}))
+        else:
+            st.warning("Es wurden mit den Filtereinstellungen keine Werte gefunden")
 
     def show_heatmap(self):
         def get_text(df, par, par_title):
@@ -895,18 +979,27 @@ class App:
 
             return text
 
-        def prepare_data(df, par):
-            par_title = par.replace(
-                ".", ""
-            )  # remove dot, as it cannot be displayed in aggrid
-            df["monat"] = df["monat"].replace(config.MONTHS_DICT)
+        def prepare_data():
             t_agg = self.settings["agg_time"]
-            df = df.groupby([t_agg["col"], t_agg["y"]])[par].agg(["mean"])
-            df["Legende"] = t_agg["legend"]
-            df = df.rename(columns={"mean": par_title}).reset_index()
-            df = df.reset_index()
+            # the cells are summed up from the cube of the data version, not from the rows
+            cube = get_heatmap_cube(
+                self.df_data,
+                self.version,
+                t_agg["col"],
+                t_agg["y"],
+                tuple(self.lst_parameters),
+            )
+            df = heatmap_means(
+                cube,
+                t_agg["col"],
+                t_agg["y"],
+                self.settings["parameters"],
+                self.get_year_range(),
+            )
+            # month names for the aggregated rows only, the shared data keeps the month numbers
+            df = df.replace({"monat": config.MONTHS_DICT})
 
-            return df, par_title
+            return df
 
         def prepare_plot(df, par, par_title):
             t_agg = self.settings["agg_time"]
@@ -928,8 +1021,8 @@ class App:
             self.settings["color"] = alt.Color(f"{par_title}:Q")
             return df
 
-        def show_plot(df):
-            chart = (
+        def get_chart(df):
+            return (
                 alt.Chart(df)
                 .mark_rect()
                 .encode(
@@ -944,25 +1037,30 @@ class App:
                     title=self.settings["plot_title"],
                 )
             )
-            st.altair_chart(chart)
 
         self.get_settings(
             self.settings["agg_time"]["settings"], self.settings["agg_time"]["defaults"]
         )
-        for par in self.settings["parameters"]:
-            df = self.filter_data()
-            df, par_title = prepare_data(df, par)
-            if len(df) > 0:
-                prepare_plot(df, par, par_title)
-                show_plot(df)
-                st.markdown(get_text(df, par, par_title))
-                with st.beta_expander("Data"):
-                    AgGrid(df)
-                    st.markdown(
-                        tools.get_table_download_link(df), unsafe_allow_html=True
-                    )
-            else:
-                st.warning("Es wurden mit den Filtereinstellungen keine Werte gefunden")
+        if len(self.settings["parameters"]) == 0:
+            return
+        df = prepare_data()
+        charts, texts = [], []
+        for par, df_par in self.split_parameters(df):
+            par_title = par.replace(
+                ".", ""
+            )  # remove dot, as it cannot be displayed in aggrid
+            df_par = df_par.drop(columns="variable").rename(columns={"mean": par_title})
+            df_par["Legende"] = self.settings["agg_time"]["legend"]
+            prepare_plot(df_par, par, par_title)
+            charts.append(get_chart(df_par))
+            texts.append(get_text(df_par, par, par_title))
+        if len(charts) > 0:
+            self.show_charts(charts)
+            for text in texts:
+                st.markdown(text)
+            self.show_table(df.rename(columns={"variable": "Parameter", "mean": "Wert"}))
+        else:
+            st.warning("Es wurden mit den Filtereinstellungen keine Werte gefunden")
 
     def show_menu(self):
         _plot_type = st.sidebar.selectbox(
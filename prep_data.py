@@ -1,13 +1,16 @@
-# script initializes data from a csv file containing all data upto now. the data is aggregated as daily values and saved in the parquet format
-# for fast retrievel into pandas. in the app, this local data is read first, if it contains the data from yesterday, it is used as is, otherwise,
+# script initializes data from a csv file containing all data upto now. the data is aggregated as daily values and saved in the parquet format,
+# one file per year, for fast retrievel into pandas. in the app, this local data is read first, if it contains the data from yesterday, it is used as is, otherwise,
 # new data is fetched from data.bs and added to the pq, which then is uptodate for the next user.
 
 import pandas as pd
 
+from partitioned_store import PartitionedStore
+from data_store import data_dict, get_raw_store, to_raw_frame
+
 URL_TEMPLATE = "https://data.bs.ch/api/explore/v2.1/catalog/datasets/{}/exports/csv?lang=de&timezone=Europe%2FBerlin&use_labels=false&delimiter=%3B"
 imports = ["prec"]
-PREC_FILE = "./data/prec.pq"
-FLOW_FILE = "./data/flow.pq"
+PREC_PATH = "./data/prec"
+FLOW_PATH = "./data/flow"
 
 if "prec" in imports:
     print("starting precipitation...")
@@ -20,7 +23,7 @@ if "prec" in imports:
     df = pd.read_csv(url, sep=";").sort_values("date")
     df.columns = ["date", "prec_mm"]
     df["date"] = pd.to_datetime(df["date"])
-    df.to_parquet(PREC_FILE)
+    PartitionedStore(PREC_PATH).write(df)
     print("precipitation finished...")
 
 if "flow" in imports:
@@ -29,16 +32,20 @@ if "flow" in imports:
     print(url)
     df = pd.read_csv(url, sep=";")
     df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True)
+    # the 10 minute values are kept as well, in monthly partitions
+    df_raw = to_raw_frame(df.rename(columns={"timestamp": "zeit"}), data_dict["flow"])
+    get_raw_store(data_dict["flow"]).write(df_raw)
     df["date"] = pd.to_datetime(df["timestamp"]).dt.date
     grouped = df[["date", "abfluss", "pegel"]].groupby("date")
     df_daily = grouped.agg({"abfluss": "mean", "pegel": "mean"}).reset_index()
-    df_daily.to_parquet(FLOW_FILE)
+    df_daily["date"] = pd.to_datetime(df_daily["date"])
+    PartitionedStore(FLOW_PATH).write(df_daily)
     print("flow finished...")
 
 print("flow")
-df = pd.read_parquet(FLOW_FILE)
+df = PartitionedStore(FLOW_PATH).read()
 print(df.head())
 
 print("precipitation")
-df = pd.read_parquet(PREC_FILE)
+df = PartitionedStore(PREC_PATH).read()
 print(df.head())
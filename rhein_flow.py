@@ -1,134 +1,99 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta, date
-import time
-import requests
+from functools import cached_property
 import pytz
 import altair as alt
+import streamlit.components.v1 as components
 from texts import texts
+from data_store import DataStore, Snapshot
+from running_stats import summary
+from animation import (
+    WIDE_CHART_WIDTH,
+    downsample_min_max,
+    get_animation_chart,
+    get_animation_data,
+    get_player_html,
+    paced_frames,
+)
 
 tz_GMT = pytz.timezone("Europe/London")
 seconds_per_day = 0.6
 month_names = {1: 'Jan', 2: 'Feb', 3: 'Mrz', 4: 'Apr', 5: 'Mai', 6: 'Jun', 7: 'Jul', 8: 'Aug', 9: 'Sep', 10: 'Okt', 11: 'Nov', 12: 'Dez'}
-data_dict = {
-    "flow": {
-        "url": "https://data.bs.ch/api/records/1.0/search/?dataset=100089&q=timestamp%3E%3D%22{}T00%3A00%3A00Z%22&rows=10000&sort=timestamp&facet=timestamp&fields=abfluss,timestamp",
-        "pq_file": "./data/flow.pq",
-        "json_fields": ["timestamp", "abfluss"],
-        "time_stamp_column": "timestamp",
-        "rename_columns": {"timestamp": "zeit"},
-        "aggregation_par": "abfluss",
-        "aggregation_func": "mean",
-    },
-    "precipitation": {
-        "url": "https://data.bs.ch/api/records/1.0/search/?dataset=100051&q=datum_zeit%3E%3D%22{}T00%3A00%3A00Z%22&rows=1000&sort=datum_zeit&facet=datum_zeit&fields=datum_zeit,prec_mm",
-        "pq_file": "./data/prec.pq",
-        "json_fields": ["datum_zeit", "prec_mm"],
-        "time_stamp_column": "datum_zeit",
-        "rename_columns": {"datum_zeit": "zeit"},
-        "aggregation_par": "prec_mm",
-        "aggregation_func": "sum",
-    },
-}
 
 
-class RheinFlow():
-    def __init__(self):
-        self.flow_df = self.get_data("flow")
-        self.precipitation_df = self.get_data("precipitation")
-        self.min_date = self.flow_df["date"].min()
-        self.max_date = self.flow_df["date"].max()
-        # convert back to datetime
-        self.min_date = datetime(self.min_date.year, self.min_date.month, self.min_date.day)
-        self.max_date = datetime(self.max_date.year, self.max_date.month, self.max_date.day)
+amazonas_km3 = 6642
+olymp_poolsize = 2.5 * 1e3  # in km3
 
-    def get_data(self, key: str):
-        def data_is_up_to_date(df):
-            """
-            Verifies whether now() is not more than 2 hours ahead of the most recent record
-            in the local data table.
-            """
-            diff = pd.to_datetime(datetime.today()) - pd.to_datetime(df["date"].max())
-            result = diff < timedelta(hours=24)
-            return result
 
-        def synch_local_data(df_local):
-            def get_url(url_template):
-                """
-                Builds the url string for the OGD.bs REST-API. unfortunatley the dataset contains data until 2050, so you cannot calculate from the
-                most recent records backwards. Therefore the most recent record in the local dataframe is taken, then the number of hour difference
-                from now is calculated and the respective number of hours = records calculated. not sure why the api contains the from and to dates
-                as well as the number of records, since that makes the system overdetermined, but wit works
-                """
-                most_recent_record = pd.to_datetime(df["date"].max())
-                most_recent_day = most_recent_record.strftime("%Y-%m-%d")
-                url = url_template.format(most_recent_day)
-                return url
+@st.cache_data(max_entries=4, show_spinner=False)
+def get_flow_stats(_flow: Snapshot, version: int, mtime: float) -> dict:
+    """
+    Tables and figures of the statistics tab, computed once per snapshot of the flow and shared
+    by all sessions. The snapshot is identified by version and mtime (it is not hashed), a sync
+    publishes a new version and the statistics are computed from its rollups and running
+    statistics, which were updated for the new days only.
+    """
+    rollups = _flow.rollups
+    df_year = rollups['year']
+    df_year = pd.DataFrame({
+        'Jahr': df_year['zeit'].dt.year.astype(str),
+        'Mittel': df_year['mean'].round(0),
+        'Minimum': df_year['min'].round(0),
+        'Maximum': df_year['max'].round(0),
+    })
+    # month of the year over all years, combined from the year-month buckets
+    month_groups = rollups['month'].groupby(rollups['month']['zeit'].dt.month.rename('month'))
+    df_month = pd.DataFrame({
+        'Mittel': (month_groups['sum'].sum() / month_groups['count'].sum()).round(0),
+        'Minimum': month_groups['min'].min().round(0),
+        'Maximum': month_groups['max'].max().round(0),
+    })
+    df_month.insert(0, 'Monat', df_month.index.map(month_names))
+    total = summary(_flow.stats)
+    mean = round(total['mean'], 1)
+    flow_year_km3 = round(mean * 3600 * 24 * 365 / 1e9, 1)
+    return {
+        'year': df_year,
+        'month': df_month.reset_index(drop=True),
+        'mean': mean,
+        'min': round(total['min'], 1),
+        'max': round(total['max'], 1),
+        'day_min': total['min_date'].strftime('%d.%m.%Y'),
+        'day_max': total['max_date'].strftime('%d.%m.%Y'),
+        'flow_year_km3': flow_year_km3,
+        'pools_no': int(3600 * 24 * 365 / olymp_poolsize),
+        'amazonas_ratio': int(round(amazonas_km3 / flow_year_km3, 0)),
+    }
 
-            def extract_data(data):
-                """
-                converts the json string into a dataframe with only the required columns
-                """
 
-                data = data["records"]
-                try:
-                    df_ogd = pd.DataFrame(data)["fields"]
-                except:
-                    print(data["records"])
-                # unpack records
-                df_ogd = pd.DataFrame(x for x in df_ogd)
+class RheinFlow():
+    """
+    Renders the app for one script run. Only the selected view is rendered and the data is taken
+    from the shared DataStore when the view first needs it, the Info view needs none. The snapshots
+    are pinned for the run on first access, so a refresh during an animation does not mix versions.
+    """
 
-                df_ogd.rename(columns=data_dict[key]["rename_columns"], inplace=True)
-                df_ogd["zeit"] = pd.to_datetime(df_ogd["zeit"])
-                df_ogd["date"] = pd.to_datetime(df_ogd["zeit"]).dt.date
-                agg_par = data_dict[key]["aggregation_par"]
-                df_ogd = (
-                    df_ogd.groupby(["date"])[agg_par]
-                    .agg(data_dict[key]["aggregation_func"])
-                    .reset_index()
-                )
-                # aggregation renames the parameter column to the aggregation function, e.g. mean, must be named back
-                df_ogd.rename(
-                    columns={
-                        data_dict[key]["aggregation_func"]: data_dict[key][
-                            "aggregation_par"
-                        ]
-                    },
-                    inplace=True,
-                )
-                # make sure there are no duplicate records
-                return df_ogd
+    def __init__(self, store: DataStore):
+        self.store = store
+        self.charts = store.charts
 
-            def combine_local_remote_data(df_new_data, df_old_data):
-                """
-                remove last day of local data and add new data, then save as parquet file
-                """
-                df_old_data = df_old_data[df_old_data["date"] < df_old_data["date"].max()]
-                # save data if df_ogd has data, meaning that more recent data was discovered
-                df_new_data = df_new_data[df_new_data["date"] > df_old_data["date"].max()]
-                if len(df_new_data) > 0:
-                    df = pd.concat([df_old_data, df_new_data])
-                    try:
-                        df.to_parquet(data_dict[key]["pq_file"])
-                    except Exception as e:
-                        st.warning("Die neusten Daten konnten nicht gespeichert werden")
-                        st.write(e)
+    @cached_property
+    def flow(self) -> Snapshot:
+        return self.store.get("flow")
 
-            url = data_dict[key]["url"]
-            data = requests.get(get_url(url)).json()
-            df_ogd = extract_data(data)
-            df_ogd["date"] = pd.to_datetime(df_ogd["date"])
-            df_ogd = combine_local_remote_data(df_ogd, df_local)
+    @cached_property
+    def precipitation(self) -> Snapshot:
+        return self.store.get("precipitation")
 
-            return df
+    @cached_property
+    def min_date(self):
+        # convert back to datetime
+        return datetime(self.flow.min_date.year, self.flow.min_date.month, self.flow.min_date.day)
 
-        df = pd.read_parquet(data_dict[key]["pq_file"])
-        df["date"] = pd.to_datetime(df["date"])
-        if not data_is_up_to_date(df):
-            with st.spinner("Daten werden aktualisiert..."):
-                df = synch_local_data(df)
-        df["date"] = pd.to_datetime(df["date"])
-        return df
+    @cached_property
+    def max_date(self):
+        return datetime(self.flow.max_date.year, self.flow.max_date.month, self.flow.max_date.day)
 
     def get_bar_chart(self, df, x, y, domain, ytitle):
         chart = (
@@ -182,36 +147,44 @@ class RheinFlow():
             st.session_state['stop'] = True
 
         def render_day(day):
-            df = self.flow_df[self.flow_df["date"] >= pd.Timestamp(start_day)]
-            df_flow = self.flow_df[self.flow_df["date"] == day]
-            wide_chart = self.get_line_chart(df, df_flow, "date", "abfluss", [0, 4000], "Abflussmenge (m³/s")
-            wide_plot_placeholder.altair_chart(
-                wide_chart.properties(width=600, height=300, title="Abflussmenge Rhein (m³/s)")
+            day = pd.Timestamp(day)
+            # the specs are cached per snapshot version, a day rendered before by any session is not serialised again
+            df_flow = self.flow.day(day)
+            wide_spec = self.charts.get(
+                ("wide_line", self.flow.version, pd.Timestamp(start_day), day, (0, 4000)),
+                lambda: self.get_line_chart(overview_df, df_flow, "date", "abfluss", [0, 4000], "Abflussmenge (m³/s").properties(
+                    width=WIDE_CHART_WIDTH, height=300, title="Abflussmenge Rhein (m³/s)"
+                ),
             )
+            wide_plot_placeholder.vega_lite_chart(wide_spec)
             # precipitation plot
-            df_prec = self.precipitation_df[self.precipitation_df["date"] == day]
-            chart = self.get_bar_chart(df_prec, "date", "prec_mm", [0, 40], "Niederschlag (mm/Tag)")
-            anim_prec.altair_chart(
-                chart.properties(
+            df_prec = self.precipitation.day(day)
+            spec = self.charts.get(
+                ("prec_bar", self.precipitation.version, day, (0, 40)),
+                lambda: self.get_bar_chart(df_prec, "date", "prec_mm", [0, 40], "Niederschlag (mm/Tag)").properties(
                     width=250, height=300, title="Niederschlag, Messtation Binningen (mm)"
-                )
+                ),
             )
+            anim_prec.vega_lite_chart(spec)
             if len(df_prec) > 0:
                 value_prec.markdown(f"Niederschlag: {df_prec.iloc[0]['prec_mm'] :.1f} mm")
             else:
                 value_prec.markdown(f"Niederschlag: {0 :.1f} mm")
 
             # flow plot
-            
-            chart = self.get_bar_chart(df_flow, "date", "abfluss", [0, 4000], "Abflussmenge (m³/s")
-            anim_pegel.altair_chart(
-                chart.properties(width=250, height=300, title="Abflussmenge Rhein (m³/s)")
+            spec = self.charts.get(
+                ("flow_bar", self.flow.version, day, (0, 4000)),
+                lambda: self.get_bar_chart(df_flow, "date", "abfluss", [0, 4000], "Abflussmenge (m³/s").properties(
+                    width=250, height=300, title="Abflussmenge Rhein (m³/s)"
+                ),
             )
+            anim_pegel.vega_lite_chart(spec)
             if len(df_flow) > 0:
                 value_pegel.markdown(f"Abflussmenge: {df_flow.iloc[0]['abfluss'] :.1f} m³/s")
             else:
                  value_pegel.markdown(f"Abflussmenge: {0 :.1f} m³/s")
         
+        player_placeholder = st.empty()  # animation played in the browser
         day_placeholder = st.empty()
         wide_plot_placeholder = st.empty()  # date selection slider
         col1, col2 = st.columns(2)  # columns with plots and text
@@ -245,63 +218,67 @@ class RheinFlow():
                     "Start Datum",
                     min_value=self.min_date,
                     max_value=self.max_date,
-                    value=date_30_days_ago,
+                    # the data may end before today if data.bs could not be reached
+                    value=min(max(date_30_days_ago, self.min_date.date()), self.max_date.date()),
+                )
+                playback_dic = {
+                    "browser": "im Browser",
+                    "server": "vom Server",
+                }
+                playback = st.radio(
+                    "Wiedergabe",
+                    playback_dic.keys(),
+                    format_func=lambda x: playback_dic[x],
+                    horizontal=True,
+                    help="Im Browser werden alle Tage einmal übertragen und lokal abgespielt. Vom Server wird jeder Tag einzeln gesendet, dies funktioniert auch ohne Zugriff auf cdn.jsdelivr.net.",
+                )
+
+            if playback == "browser":
+                days = (self.max_date.date() - start_day).days + 1
+                spec_json = self.charts.get_json(
+                    ("animation", self.flow.version, self.precipitation.version, pd.Timestamp(start_day), pd.Timestamp(self.max_date)),
+                    lambda: get_animation_chart(
+                        get_animation_data(self.flow.between(start_day), self.precipitation.between(start_day), start_day, self.max_date)
+                    ),
                 )
+                with player_placeholder:
+                    components.html(get_player_html(spec_json, days, seconds_per_day), height=820)
+                return
 
+            # the wide chart is sent with every day, its line is reduced to the chart resolution
+            overview_df = downsample_min_max(self.flow.between(start_day), "abfluss")
             render_day(start_day)
             day_placeholder.markdown(f"**{start_day.strftime('%d.%m.%Y')}**")
             with stop_button:
-                st.button('Stop Animation', on_click=interrupt_animation())
+                st.button('Stop Animation', on_click=interrupt_animation)
             with run_button:
                 if st.button("Animation starten"):
                     st.session_state['stop'] = False
-                    datelist = pd.date_range(start=start_day, end=self.max_date).tolist()
-                    # datelist = [date + timedelta(days=x) for x in range((max_date - day).days + 1)]
-                    for day in datelist:
-                        # day selector is used for display only, the variable day is used from the loop
+                    datelist = pd.date_range(start=start_day, end=self.max_date)
+                    # days are skipped if rendering takes longer than seconds_per_day, the speed stays the same
+                    for i in paced_frames(len(datelist), seconds_per_day):
+                        day = datelist[i]
                         render_day(day)
-                        time.sleep(seconds_per_day)
                         day_placeholder.markdown(f"**{day.strftime('%d.%m.%Y')}**")
                         if st.session_state['stop']:
                             break
             
     def show_stats(self):
+        with st.spinner("Daten werden geladen..."):
+            stats = get_flow_stats(self.flow, self.flow.version, self.flow.mtime)
         col1, col2 = st.columns(2)
-        df = self.flow_df
-        df['year'] = df['date'].dt.year
-        df['month'] = df['date'].dt.month
-        df_year = df.groupby('year')['abfluss'].agg(['mean', 'min', 'max']).reset_index()
-        df_month = df.groupby('month')['abfluss'].agg(['mean', 'min', 'max']).reset_index()
-        
         with col1:
             st.markdown('**Jahres-Statistik**')
-            df_year = df_year.applymap(lambda x: round(x, 0))
-            df_year['year'] = df_year['year'].astype(str)
-            df_year.columns = ['Jahr', 'Mittel', 'Minimum', 'Maximum']
-            st.dataframe(df_year, hide_index=True)
+            st.dataframe(stats['year'], hide_index=True)
             st.markdown('Jahres Tagesmittel der Abflussmenge [m³/s] sowie Tages-Minimum und -Maximum im Jahr seit 2020. Aktuelles Jahr mit Daten bis zum aktuellen Zeitpunkt.')
         with col2:
             st.markdown('**Monats-Statistik**')
-            df_year.columns = ['Monat', 'Mittel', 'Minimum', 'Maximum']
-            df_month = df_month.applymap(lambda x: round(x, 0))
-            df_month = df_month.applymap(lambda x: round(x, 0))
-            df_month['month'] = df_month['month'].map(month_names)
-            df_month.columns = ['Monat', 'Mittel', 'Minimum', 'Maximum']
-            st.dataframe(df_month, hide_index=True)
+            st.dataframe(stats['month'], hide_index=True)
             st.markdown('Monatliches Mitttel der Tages-Abflussmenge [m³/s] sowie tägliches Minimum und Maximum pro Monat seit 2020')
-        mean = round(df['abfluss'].mean(), 1)
-        min = round(df['abfluss'].min(), 1)
-        max = round(df['abfluss'].max(), 1)
-        day_min = df['date'].loc[df['abfluss'].idxmin()].strftime('%d.%m.%Y')
-        day_max = df['date'].loc[df['abfluss'].idxmax()].strftime('%d.%m.%Y')
-        flow_year_km3 = round(mean * 3600 * 24 * 365 / 1e9, 1)
-        olymp_poolsize = 2.5 * 1e3 # in km3
-        pools_no = int(3600 * 24 * 365 / olymp_poolsize)
-        amazonas_km3 = 6642
-        text = f'''Über den gesamten Zeitraum beträgt das Tagesmittel {mean} m³/s. Der Geringste Abfluss beträgt {min} m³/s und wurde am {day_min} 
-gemessen. Der grösste Abfluss beträgt {max} m³/s am {day_max} gemessen. Im Mittel beträgt der jährlich Abfluss somit {flow_year_km3} km³/s. 
-Mit diesem Volumen liessen sich {pools_no} olympische Schwimmbecken füllen. Der Abfluss des Rheins ist allerdings immer noch recht bescheiden verglichen mit dem Amazonas, 
-dem wasserreichsten Fluss der Welt. Sein Jahresabfluss beträgt {amazonas_km3} km³, also rund {int(round(amazonas_km3 / flow_year_km3, 0))} Mal mehr.'''
+        text = f'''Über den gesamten Zeitraum beträgt das Tagesmittel {stats['mean']} m³/s. Der Geringste Abfluss beträgt {stats['min']} m³/s und wurde am {stats['day_min']} 
+gemessen. Der grösste Abfluss beträgt {stats['max']} m³/s am {stats['day_max']} gemessen. Im Mittel beträgt der jährlich Abfluss somit {stats['flow_year_km3']} km³/s. 
+Mit diesem Volumen liessen sich {stats['pools_no']} olympische Schwimmbecken füllen. Der Abfluss des Rheins ist allerdings immer noch recht bescheiden verglichen mit dem Amazonas, 
+dem wasserreichsten Fluss der Welt. Sein Jahresabfluss beträgt {amazonas_km3} km³, also rund {stats['amazonas_ratio']} Mal mehr.'''
         st.markdown(text)
 
     def show_gui(self):
@@ -316,11 +293,18 @@ dem wasserreichsten Fluss der Welt. Sein Jahresabfluss beträgt {amazonas_km3} k
         )
         st.markdown("<small>[Quelle Abbildung](https://www.bs.ch/bilddatenbank)<small>", unsafe_allow_html=True)
         st.header("Rhein-Abfluss in Basel")
-        tabs = st.tabs(['Info', 'Statistiken', 'Animierte Grafik'])
-        
-        with tabs[0]:
+        # a selector instead of st.tabs: tabs run the code of all tabs on every run and would load
+        # every dataset, here only the selected view is rendered
+        view = st.radio(
+            "Ansicht",
+            ['Info', 'Statistiken', 'Animierte Grafik'],
+            horizontal=True,
+            label_visibility="collapsed",
+            key="view",
+        )
+        if view == 'Info':
             self.show_info()
-        with tabs[1]:
+        elif view == 'Statistiken':
             self.show_stats()
-        with tabs[2]:
-            self.show_animation()
\ No newline at end of file
+        else:
+            self.show_animation()
@@ -0,0 +1,90 @@
+import os
+
+import pandas as pd
+
+from partitioned_store import write_parquet_atomic
+
+# levels of the rollup pyramid and the period of their buckets, W-SUN weeks end on sunday, i.e. start on monday
+levels = {"hour": "h", "day": "D", "week": "W-SUN", "month": "M", "year": "Y"}
+aggregates = ["mean", "min", "max", "sum", "count"]
+
+
+def bucket_start(times, level: str):
+    return times.dt.to_period(levels[level]).dt.start_time
+
+
+def aggregate(df, level: str, value_column: str, time_column: str):
+    """
+    one row per bucket of the level with the bucket start as zeit and the aggregates of value_column.
+    """
+    if len(df) == 0:
+        return pd.DataFrame(columns=["zeit"] + aggregates)
+    df_level = df.groupby(bucket_start(df[time_column], level).rename("zeit"))[value_column].agg(aggregates)
+    return df_level.reset_index()
+
+
+def rollup(df, level: str, value_columns: list, time_column: str = "zeit", how: str = "mean"):
+    """
+    aggregates a raw series to one row per bucket of the level with the bucket start as zeit and
+    the aggregate how (one of aggregates) of each value column, the buckets of the pyramid.
+    buckets without values are dropped.
+    """
+    columns = [aggregate(df, level, x, time_column).set_index("zeit")[how].rename(x) for x in value_columns]
+    df = pd.concat(columns, axis=1)
+    df.index.name = "zeit"
+    return df.dropna(how="all").reset_index()
+
+
+def build_rollups(df_daily, value_column: str, df_raw=None) -> dict:
+    """
+    Materialised rollup pyramid of a dataset, a dataframe per level with the columns zeit (bucket
+    start), mean, min, max, sum and count. The hour level summarises the raw values, the day and
+    coarser levels summarise the daily values (daily mean of the flow, daily sum of the
+    precipitation), as the statistics of the app refer to daily values. Without raw series the
+    hour level is empty.
+    """
+    rollups = {}
+    for level in levels:
+        if level == "hour":
+            df = df_raw if df_raw is not None else pd.DataFrame(columns=["zeit", value_column])
+            rollups[level] = aggregate(df, level, value_column, "zeit")
+        else:
+            rollups[level] = aggregate(df_daily, level, value_column, "date")
+    return rollups
+
+
+def update_rollups(rollups: dict, df_daily, value_column: str, start, df_raw=None) -> dict:
+    """
+    returns a new pyramid in which only the buckets from the one holding start on are recomputed,
+    e.g. the current week, month and year after a sync. df_daily must hold the daily values of
+    these buckets (at most the current year), df_raw the raw values from start on.
+    """
+    result = {}
+    for level, df_level in rollups.items():
+        first_bucket = bucket_start(pd.Series([pd.Timestamp(start)]), level)[0]
+        if level == "hour":
+            if df_raw is None:
+                result[level] = df_level
+                continue
+            df_new = aggregate(df_raw[df_raw["zeit"] >= first_bucket], level, value_column, "zeit")
+        else:
+            df_new = aggregate(df_daily[df_daily["date"] >= first_bucket], level, value_column, "date")
+        parts = [x for x in [df_level[df_level["zeit"] < first_bucket], df_new] if len(x) > 0]
+        result[level] = pd.concat(parts, ignore_index=True) if len(parts) > 0 else df_new
+    return result
+
+
+def load_rollups(path: str):
+    """
+    reads the pyramid saved with save_rollups, None if a level is missing.
+    """
+    try:
+        return {level: pd.read_parquet(os.path.join(path, f"{level}.pq")) for level in levels}
+    except FileNotFoundError:
+        return None
+
+
+def save_rollups(path: str, rollups: dict):
+    os.makedirs(path, exist_ok=True)
+    for level, df_level in rollups.items():
+        write_parquet_atomic(df_level, os.path.join(path, f"{level}.pq"))
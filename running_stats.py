@@ -0,0 +1,122 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# accumulator without values, see add_values
+empty_accumulator = {
+    "count": 0,
+    "mean": 0.0,
+    "m2": 0.0,
+    "sum": 0.0,
+    "min": None,
+    "min_date": None,
+    "max": None,
+    "max_date": None,
+    "until": None,
+}
+
+
+def add_values(accumulator: dict, dates, values) -> dict:
+    """
+    returns a new accumulator holding the values of accumulator and values (with their dates, in
+    time order). the mean and the sum of squared deviations m2 are merged with the parallel form of
+    Welford's update, so the variance stays exact without keeping the values. an extreme reached
+    again keeps the date it was first reached.
+    """
+    values = np.asarray(values, dtype="float64")
+    valid = ~np.isnan(values)
+    dates, values = np.asarray(dates)[valid], values[valid]
+    if len(values) == 0:
+        return accumulator
+    result = dict(accumulator)
+    count, batch_count = accumulator["count"], len(values)
+    batch_mean = values.mean()
+    delta = batch_mean - accumulator["mean"]
+    result["count"] = count + batch_count
+    result["mean"] = accumulator["mean"] + delta * batch_count / result["count"]
+    result["m2"] = accumulator["m2"] + ((values - batch_mean) ** 2).sum() + delta**2 * count * batch_count / result["count"]
+    result["sum"] = accumulator["sum"] + values.sum()
+    for name, position in [("min", values.argmin()), ("max", values.argmax())]:
+        value = float(values[position])
+        if accumulator[name] is None or (value < accumulator[name] if name == "min" else value > accumulator[name]):
+            result[name] = value
+            result[f"{name}_date"] = pd.Timestamp(dates[position]).strftime("%Y-%m-%d")
+    result["until"] = pd.Timestamp(dates[-1]).strftime("%Y-%m-%d")
+    for key in ["mean", "m2", "sum"]:
+        result[key] = float(result[key])
+    return result
+
+
+def build_stats(df_daily, value_column: str) -> dict:
+    """
+    Running statistics of the daily values of a dataset: count, sum, mean, variance (as m2) and the
+    extremes with their dates. The last day is still open, its value changes with every sync until
+    the day is over, so it is kept apart from the accumulator of the closed days and merged in by
+    summary().
+    """
+    df_daily = df_daily.sort_values("date")
+    closed = add_values(empty_accumulator, df_daily["date"].iloc[:-1], df_daily[value_column].iloc[:-1])
+    return {"closed": closed, "open": open_day(df_daily, value_column)}
+
+
+def open_day(df_daily, value_column: str):
+    if len(df_daily) == 0:
+        return None
+    return {"date": df_daily["date"].iloc[-1].strftime("%Y-%m-%d"), "value": float(df_daily[value_column].iloc[-1])}
+
+
+def update_stats(stats: dict, df_daily, value_column: str) -> dict:
+    """
+    returns the statistics after a sync: the days closed since the last update are added to the
+    accumulator and the last day becomes the open one. df_daily must be sorted by date, only the
+    rows after the last closed day are read, so an update costs O(new days).
+    """
+    until = stats["closed"]["until"]
+    first = 0 if until is None else df_daily["date"].searchsorted(pd.Timestamp(until), side="right")
+    df_new = df_daily.iloc[first:]
+    closed = add_values(stats["closed"], df_new["date"].iloc[:-1], df_new[value_column].iloc[:-1])
+    return {"closed": closed, "open": open_day(df_daily, value_column)}
+
+
+def summary(stats: dict) -> dict:
+    """
+    statistics over all days including the open one: count, sum, mean, std (sample standard
+    deviation), min and max with the dates (Timestamps) they were reached.
+    """
+    total = stats["closed"]
+    if stats["open"] is not None:
+        total = add_values(total, [pd.Timestamp(stats["open"]["date"])], [stats["open"]["value"]])
+    result = {key: total[key] for key in ["count", "sum", "mean", "min", "max"]}
+    result["std"] = (total["m2"] / (total["count"] - 1)) ** 0.5 if total["count"] > 1 else 0.0
+    for key in ["min_date", "max_date"]:
+        result[key] = pd.Timestamp(total[key]) if total[key] is not None else None
+    return result
+
+
+def is_current(stats: dict, max_date) -> bool:
+    """
+    true if the statistics end with max_date, the last day of the daily values, as for the rollups.
+    """
+    if stats is None or stats["open"] is None:
+        return False
+    return stats["open"]["date"] == pd.Timestamp(max_date).strftime("%Y-%m-%d")
+
+
+def load_stats(path: str):
+    """
+    reads the statistics saved with save_stats, None if there are none.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_stats(path: str, stats: dict):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(stats, f, indent=4)
+    os.replace(tmp_path, path)
@@ -0,0 +1,57 @@
+import pytest
+
+from animation import paced_frames
+
+
+class FakeClock:
+    """
+    simulated clock for paced_frames, sleep advances the time instead of waiting.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        assert seconds >= 0
+        self.now += seconds
+
+
+def play(frames: int, seconds_per_frame: float, render_seconds: float):
+    """
+    plays the frames with a render time per frame, returns the rendered frames and the time each
+    one was shown.
+    """
+    clock = FakeClock()
+    shown = []
+    for frame in paced_frames(frames, seconds_per_frame, clock=clock, sleep=clock.sleep):
+        shown.append((frame, clock.now))
+        clock.now += render_seconds
+    return shown
+
+
+def test_fast_render_shows_every_frame_on_time():
+    shown = play(20, 0.5, 0.1)
+    assert [frame for frame, _ in shown] == list(range(20))
+    # frame i is shown at i * seconds_per_frame, the render time is taken from the pause
+    assert [time for _, time in shown] == pytest.approx([i * 0.5 for i in range(20)])
+
+
+def test_slow_render_skips_frames_and_shows_the_last():
+    shown = play(20, 0.5, 1.2)
+    frames = [frame for frame, _ in shown]
+    assert len(frames) < 20
+    assert frames == sorted(set(frames))
+    assert frames[-1] == 19
+    # no pause while behind schedule: the playback takes about as long as at full speed
+    assert shown[-1][1] == pytest.approx(19 * 0.5, abs=1.2)
+
+
+@pytest.mark.parametrize("render_seconds", [0.0, 0.1, 0.49, 0.7, 2.0])
+def test_total_time_follows_the_frame_rate(render_seconds):
+    shown = play(40, 0.25, render_seconds)
+    assert shown[-1][0] == 39
+    total = shown[-1][1] + max(render_seconds, 0.25)
+    assert total == pytest.approx(40 * 0.25, abs=render_seconds + 0.25)
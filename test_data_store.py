@@ -0,0 +1,226 @@
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_store import DataStore
+from partitioned_store import PartitionedStore
+
+
+class StubApi(BaseHTTPRequestHandler):
+    """
+    data.bs api with the records of server.records: the dataset metadata with an ETag (304 if the
+    client sends it back) and the records search with the time stamp filter, sort and rows used by
+    ogd_client.fetch_pages. every request is recorded in server.requests.
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.server.requests.append(url.path)
+        if url.path.startswith("/explore/"):
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_json({"dataset_id": url.path.rsplit("/", 1)[-1]}, {"ETag": '"v1"'})
+        elif url.path == "/records/1.0/search/":
+            if self.server.failing_pages == 0:
+                # e.g. a lost connection in the middle of a catch-up, not retried
+                self.send_response(404)
+                self.end_headers()
+                return
+            self.server.failing_pages -= 1
+            params = parse_qs(url.query)
+            # e.g. timestamp>="2024-01-01T00:00:00Z" AND timestamp<="2024-01-10T12:00:00Z"
+            lower, upper = params["q"][0].split(" AND ")
+            cursor, until = lower.split('"')[1][:19], upper.split('"')[1][:19]
+            inclusive = ">=" in lower
+            records = [
+                x for x in self.server.records
+                if (x["timestamp"][:19] >= cursor if inclusive else x["timestamp"][:19] > cursor)
+                and x["timestamp"][:19] <= until
+            ]
+            rows = int(params["rows"][0])
+            self.send_json({"records": [{"fields": x} for x in records[:rows]]})
+        else:
+            self.send_response(404)
+            self.end_headers()
+
+    def send_json(self, data: dict, headers: dict = {}):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubApi)
+    server.requests = []
+    server.records = []
+    # number of record pages served before the stub fails, -1 for no failure
+    server.failing_pages = -1
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_store(tmp_path, stub_server) -> DataStore:
+    """
+    store with a flow dataset in tmp_path, daily values until 10 days ago, and the stub serving the
+    10 minute values from then until now.
+    """
+    today = pd.Timestamp(datetime.now(timezone.utc).date())
+    dates = pd.date_range(today - timedelta(days=400), today - timedelta(days=10))
+    PartitionedStore(str(tmp_path / "flow")).write(pd.DataFrame({"date": dates, "abfluss": np.full(len(dates), 800.0)}))
+    zeit = pd.date_range(today - timedelta(days=10), datetime.now(timezone.utc).replace(tzinfo=None), freq="10min")
+    stub_server.records = [
+        {"timestamp": f"{x:%Y-%m-%dT%H:%M:%S}+00:00", "abfluss": 1000.0, "pegel": 245.0} for x in zeit
+    ]
+    sources = {
+        "flow": {
+            "api_url": f"http://127.0.0.1:{stub_server.server_address[1]}/",
+            # the validators of ogd_client are kept per dataset and process
+            "dataset": f"stub-{tmp_path.name}",
+            "path": str(tmp_path / "flow"),
+            "raw_path": str(tmp_path / "flow_raw"),
+            "rollups_path": str(tmp_path / "flow_rollups"),
+            "stats_path": str(tmp_path / "flow_stats.json"),
+            "series_path": str(tmp_path / "flow.arrow"),
+            "json_fields": ["timestamp", "abfluss", "pegel"],
+            "time_stamp_column": "timestamp",
+            "aggregation_par": "abfluss",
+            "aggregation_func": "mean",
+            "timeout": 30,
+        }
+    }
+    return DataStore(sources)
+
+
+def metadata_requests(stub_server) -> int:
+    return sum(x.startswith("/explore/") for x in stub_server.requests)
+
+
+def record_requests(stub_server) -> int:
+    return stub_server.requests.count("/records/1.0/search/")
+
+
+def test_refresh_fetches_once_and_publishes(tmp_path, stub_server):
+    store = make_store(tmp_path, stub_server)
+    today = pd.Timestamp(datetime.now(timezone.utc).date())
+    assert store.get("flow").version == 1
+
+    store.refresh()
+    # one metadata request and the records in two pages of 1000
+    assert metadata_requests(stub_server) == 1
+    assert record_requests(stub_server) == 2
+    snapshot = store.get("flow")
+    assert snapshot.version == 2
+    assert snapshot.max_date == today
+    assert snapshot.day(today - timedelta(days=5))["abfluss"].iloc[0] == 1000.0
+    assert not (tmp_path / "flow.checkpoint.json").exists()
+
+    requests = len(stub_server.requests)
+    store.refresh()
+    # the data is up to date, the second refresh sends no request and publishes nothing
+    assert len(stub_server.requests) == requests
+    assert store.get("flow").version == 2
+
+
+def test_concurrent_syncs_fetch_once(tmp_path, stub_server):
+    store = make_store(tmp_path, stub_server)
+    store.get("flow")
+    threads = [threading.Thread(target=store.synch, args=("flow",)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # the first thread syncs, the others wait for the lock and find the data up to date
+    assert metadata_requests(stub_server) == 1
+    assert record_requests(stub_server) == 2
+    assert store.get("flow").version == 2
+
+
+def test_interrupted_catch_up_resumes_at_checkpoint(tmp_path, stub_server, monkeypatch):
+    monkeypatch.setattr("data_store.SYNC_RETRY_INTERVAL", timedelta(0))
+    store = make_store(tmp_path, stub_server)
+    stub_server.failing_pages = 1
+    store.refresh()
+    # the first page is checkpointed, the failed sync publishes nothing
+    assert record_requests(stub_server) == 2
+    assert (tmp_path / "flow.checkpoint.json").exists()
+    assert store.get("flow").version == 1
+
+    stub_server.failing_pages = -1
+    store.refresh()
+    # the validators were not marked as synchronised, the catch-up continues after the first page
+    assert metadata_requests(stub_server) == 2
+    assert record_requests(stub_server) == 3
+    assert not (tmp_path / "flow.checkpoint.json").exists()
+    snapshot = store.get("flow")
+    assert snapshot.version == 2
+    days = snapshot.between(snapshot.max_date - timedelta(days=9), snapshot.max_date)
+    assert (days["abfluss"] == 1000.0).all()
+
+
+def test_refresh_of_current_data_loads_nothing(tmp_path, stub_server):
+    store = make_store(tmp_path, stub_server)
+    today = pd.Timestamp(datetime.now(timezone.utc).date())
+    dates = pd.date_range(today - timedelta(days=10), today)
+    PartitionedStore(str(tmp_path / "flow")).write(pd.DataFrame({"date": dates, "abfluss": np.full(len(dates), 900.0)}))
+    store.refresh()
+    # the last day is read from the manifest, the dataset is not loaded and nothing is fetched
+    assert stub_server.requests == []
+    assert store._snapshots == {}
+
+
+def test_failure_after_write_is_logged_and_recovered(tmp_path, stub_server, monkeypatch, caplog):
+    store = make_store(tmp_path, stub_server)
+    today = pd.Timestamp(datetime.now(timezone.utc).date())
+    store.get("flow")
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr("data_store.update_rollups", fail)
+    store.refresh()
+    # the partitions are written, the rollups are not: the error is logged, nothing is published
+    assert "disk full" in caplog.text
+    assert store.get("flow").version == 1
+    assert PartitionedStore(str(tmp_path / "flow")).partitions()[-1]["max_date"].startswith(f"{today:%Y-%m-%d}")
+
+    monkeypatch.undo()
+    requests = len(stub_server.requests)
+    store.refresh()
+    # the partitions are newer than the snapshot, the next sync reloads them without a request
+    assert len(stub_server.requests) == requests
+    snapshot = store.get("flow")
+    assert snapshot.version == 2
+    assert snapshot.rollups["day"]["zeit"].max() == today
+    assert snapshot.stats["open"]["date"] == f"{today:%Y-%m-%d}"
+
+
+def test_refresh_logs_errors_outside_the_sync(tmp_path, stub_server, monkeypatch, caplog):
+    store = make_store(tmp_path, stub_server)
+    store.get("flow")
+
+    def fail(source):
+        raise OSError("partitions unreadable")
+
+    monkeypatch.setattr("data_store.load_local_data", fail)
+    store.refresh()
+    assert "Synchronisation von flow fehlgeschlagen" in caplog.text
+    assert "partitions unreadable" in caplog.text
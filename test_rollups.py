@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from rollups import build_rollups, levels, update_rollups
+
+
+def daily_values(start: str, end: str, seed: int):
+    dates = pd.date_range(start, end)
+    values = np.random.default_rng(seed).uniform(500, 1500, len(dates))
+    return pd.DataFrame({"date": dates, "abfluss": values})
+
+
+def raw_values(start: str, end: str, seed: int):
+    zeit = pd.date_range(start, end, freq="10min")
+    values = np.random.default_rng(seed).uniform(500, 1500, len(zeit))
+    return pd.DataFrame({"zeit": zeit, "abfluss": values})
+
+
+# a monday (the first day of a week), a wednesday and the last day of the year
+@pytest.mark.parametrize("cut", ["2023-12-25", "2023-12-27", "2023-12-31"])
+def test_update_matches_build(cut):
+    cut = pd.Timestamp(cut)
+    df_daily = daily_values("2023-06-01", "2024-02-15", 1)
+    df_raw = raw_values("2023-12-01", "2024-02-15", 2)
+    # at the last sync the cut day was still open, its value changed with the values fetched since
+    df_daily_old = df_daily[df_daily["date"] <= cut].copy()
+    df_daily_old.loc[df_daily_old.index[-1], "abfluss"] = 100.0
+    df_raw_old = df_raw[df_raw["zeit"] <= cut + pd.Timedelta(hours=12)]
+
+    rollups = build_rollups(df_daily_old, "abfluss", df_raw_old)
+    updated = update_rollups(rollups, df_daily, "abfluss", cut, df_raw[df_raw["zeit"] >= cut])
+    expected = build_rollups(df_daily, "abfluss", df_raw)
+    for level in levels:
+        pd.testing.assert_frame_equal(updated[level], expected[level], check_dtype=False)
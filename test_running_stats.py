@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from running_stats import build_stats, summary, update_stats
+
+
+def daily_values(start: str, end: str, seed: int):
+    dates = pd.date_range(start, end)
+    values = np.random.default_rng(seed).uniform(500, 1500, len(dates))
+    return pd.DataFrame({"date": dates, "abfluss": values})
+
+
+# a monday (the first day of a week), a wednesday and the last day of the year
+@pytest.mark.parametrize("cut", ["2023-12-25", "2023-12-27", "2023-12-31"])
+def test_update_matches_build(cut):
+    cut = pd.Timestamp(cut)
+    df_daily = daily_values("2023-06-01", "2024-02-15", 1)
+    # at the last sync the cut day was still open, with a value below all others
+    df_daily_old = df_daily[df_daily["date"] <= cut].copy()
+    df_daily_old.loc[df_daily_old.index[-1], "abfluss"] = 100.0
+
+    updated = update_stats(build_stats(df_daily_old, "abfluss"), df_daily, "abfluss")
+    expected = build_stats(df_daily, "abfluss")
+    for key in ["count", "sum", "min", "min_date", "max", "max_date", "until"]:
+        assert updated["closed"][key] == pytest.approx(expected["closed"][key]), key
+    assert np.allclose(
+        [updated["closed"]["mean"], updated["closed"]["m2"]], [expected["closed"]["mean"], expected["closed"]["m2"]]
+    )
+    assert updated["open"] == expected["open"]
+    assert summary(updated)["std"] == pytest.approx(df_daily["abfluss"].std())